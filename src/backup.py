@@ -0,0 +1,263 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+
+
+def entry_hash(entry):
+    """
+    Hash the content of a journal entry.
+
+    :param entry: The journal entry dictionary.
+    :type entry: dict
+
+    :return: A short hex digest that changes whenever the entry does.
+    :rtype: str
+    """
+    data = json.dumps(entry, sort_keys=True).encode("utf-8")
+    return hashlib.sha1(data).hexdigest()[:16]
+
+
+class BackupManager:
+    """
+    Keep incremental, deduplicated backups of a journal in a directory.
+
+    Every backup is a gzipped JSON Lines file of change records in the same form as
+    the storage log: {"op": "add", "entry": ...} or {"op": "delete", "id": ...}. A full
+    checkpoint records every entry. The backups in between only record the entries
+    that were added, changed or deleted since the backup before, which is found by
+    comparing content hashes, so an unchanged journal costs nothing to back up.
+
+    manifest.json lists the backups in order. Any of them can be restored by replaying
+    the last full checkpoint at or before it, followed by the incremental backups up
+    to it. hashes.json holds the hash of every entry as of the latest backup.
+    """
+
+    def __init__(self, directory="backups", full_every=7, keep_full=4):
+        """
+        Initialise the backup manager.
+
+        :param directory: Optional. Where backups are kept. Default is 'backups'.
+        :type directory: str
+        :param full_every: Optional. Take a full checkpoint after this many incremental
+            backups in a row. Default is 7.
+        :type full_every: int
+        :param keep_full: Optional. How many full checkpoints to keep, along with the
+            incremental backups that follow them, at least 1. Older backups are pruned.
+            Default is 4.
+        :type keep_full: int
+        """
+        self.directory = directory
+        self.manifest_file = os.path.join(directory, "manifest.json")
+        self.hashes_file = os.path.join(directory, "hashes.json")
+        self.full_every = full_every
+        self.keep_full = keep_full
+
+    def load_manifest(self):
+        """
+        Read the list of backups.
+
+        :return: One record per backup, oldest first, each with the backup's "name",
+            "kind" ('full' or 'incremental'), "file", "created" time and number of "changes".
+        :rtype: list
+        """
+        if not os.path.exists(self.manifest_file):
+            return []
+        with open(self.manifest_file, "r") as file:
+            return json.load(file)
+
+    def write_json(self, path, data):
+        """Write a JSON file atomically, via a temporary file"""
+        temp_file = path + ".tmp"
+        with open(temp_file, "w") as file:
+            file.write(json.dumps(data, indent=4))
+        os.replace(temp_file, path)
+
+    def load_hashes(self, manifest):
+        """
+        Read the entry hashes recorded by the latest backup.
+
+        :param manifest: The current manifest.
+        :type manifest: list
+
+        :return: A mapping of journal ID to entry hash, or None if there is no usable
+            record of the latest backup, in which case the next backup must be full.
+        :rtype: dict or None
+        """
+        if not manifest or not os.path.exists(self.hashes_file):
+            return None
+        with open(self.hashes_file, "r") as file:
+            data = json.load(file)
+        if data.get("backup") != manifest[-1]["name"]:
+            return None
+        return {int(journal_id): digest for journal_id, digest in data["hashes"].items()}
+
+    def backup(self, entries, full=False):
+        """
+        Back up a journal.
+
+        :param entries: Every journal entry dictionary in the journal.
+        :type entries: iterable
+        :param full: Optional. Take a full checkpoint even if one isn't due. Default is False.
+        :type full: bool
+
+        :return: The manifest record of the new backup, or None if nothing has changed
+            since the last one.
+        :rtype: dict or None
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        manifest = self.load_manifest()
+        previous = self.load_hashes(manifest)
+        since_full = 0
+        for record in reversed(manifest):
+            if record["kind"] == "full":
+                break
+            since_full += 1
+        # A full checkpoint is needed if there is nothing to compare against, no earlier
+        # checkpoint to build on, or the chain of incremental backups is long enough
+        if previous is None or since_full == len(manifest) or since_full >= self.full_every:
+            full = True
+
+        now = datetime.datetime.now()
+        stamp = now.strftime("%Y%m%d_%H%M%S")
+        names = {record["name"] for record in manifest}
+        name = stamp
+        suffix = 1
+        # Backups taken in the same second get a suffix
+        while name in names or os.path.exists(
+            os.path.join(self.directory, f"backup_{name}.jsonl.gz")
+        ):
+            name = f"{stamp}_{suffix}"
+            suffix += 1
+        filename = f"backup_{name}.jsonl.gz"
+        path = os.path.join(self.directory, filename)
+
+        hashes = {}
+        changes = 0
+        with gzip.open(path + ".tmp", "wt", encoding="utf-8") as file:
+            for entry in entries:
+                digest = entry_hash(entry)
+                hashes[entry["id"]] = digest
+                if full or previous.get(entry["id"]) != digest:
+                    file.write(json.dumps({"op": "add", "entry": entry}) + "\n")
+                    changes += 1
+            if not full:
+                for journal_id in previous.keys() - hashes.keys():
+                    file.write(json.dumps({"op": "delete", "id": journal_id}) + "\n")
+                    changes += 1
+
+        if not full and not changes:
+            os.remove(path + ".tmp")
+            return None
+        os.replace(path + ".tmp", path)
+        record = {
+            "name": name,
+            "kind": "full" if full else "incremental",
+            "file": filename,
+            "created": now.isoformat(timespec="seconds"),
+            "changes": changes,
+        }
+        manifest.append(record)
+        # If only one of these is written, the hashes won't name the latest backup in the
+        # manifest, and the next backup will be a full checkpoint
+        self.write_json(self.hashes_file, {"backup": name, "hashes": hashes})
+        self.write_json(self.manifest_file, manifest)
+        self.prune()
+        return record
+
+    def read_backup(self, record):
+        """
+        Read the change records in a backup.
+
+        :param record: The backup's manifest record.
+        :type record: dict
+
+        :return: A generator of change records.
+        :rtype: generator
+        """
+        with gzip.open(os.path.join(self.directory, record["file"]), "rt") as file:
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+
+    def find_backup(self, manifest, name=None, at=None):
+        """
+        Find a backup in the manifest.
+
+        :param manifest: The manifest to search.
+        :type manifest: list
+        :param name: Optional. The name of the backup.
+        :type name: str
+        :param at: Optional. Find the latest backup taken at or before this time.
+        :type at: datetime.datetime
+
+        :return: The position of the backup in the manifest. With neither name nor at,
+            this is the latest backup.
+        :rtype: int
+
+        :raises ValueError: If there is no matching backup.
+        """
+        for position in range(len(manifest) - 1, -1, -1):
+            record = manifest[position]
+            if name is not None:
+                if record["name"] == name:
+                    return position
+            elif at is None or datetime.datetime.fromisoformat(record["created"]) <= at:
+                return position
+        if name is not None:
+            raise ValueError(f"No backup named {name}")
+        raise ValueError("No backup was taken at or before that time")
+
+    def restore_entries(self, name=None, at=None):
+        """
+        Rebuild a journal as it was when a backup was taken.
+
+        :param name: Optional. The name of the backup to restore.
+        :type name: str
+        :param at: Optional. Restore the latest backup taken at or before this time.
+        :type at: datetime.datetime
+
+        :return: The journal entry dictionaries, in ID order. With neither name nor
+            at, the latest backup is restored.
+        :rtype: list
+
+        :raises ValueError: If there is no matching backup.
+        """
+        manifest = self.load_manifest()
+        end = self.find_backup(manifest, name, at)
+        start = end
+        while manifest[start]["kind"] != "full":
+            start -= 1
+        entries = {}
+        for record in manifest[start : end + 1]:
+            for change in self.read_backup(record):
+                if change["op"] == "add":
+                    entries[change["entry"]["id"]] = change["entry"]
+                elif change["op"] == "delete":
+                    entries.pop(change["id"], None)
+        return [entries[journal_id] for journal_id in sorted(entries)]
+
+    def prune(self):
+        """
+        Delete backups older than the last keep_full full checkpoints.
+
+        :return: The manifest records of the backups that were deleted.
+        :rtype: list
+        """
+        manifest = self.load_manifest()
+        fulls = [
+            position
+            for position, record in enumerate(manifest)
+            if record["kind"] == "full"
+        ]
+        if len(fulls) <= self.keep_full:
+            return []
+        cutoff = fulls[-self.keep_full]
+        pruned, manifest = manifest[:cutoff], manifest[cutoff:]
+        self.write_json(self.manifest_file, manifest)
+        for record in pruned:
+            path = os.path.join(self.directory, record["file"])
+            if os.path.exists(path):
+                os.remove(path)
+        return pruned
@@ -0,0 +1,694 @@
+import argparse
+import contextlib
+import datetime
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from backup import BackupManager
+from scribe import Journal, JournalBook, migrate_storage, read_import_file
+from storage import JsonStorage
+
+WORDS = (
+    "today worked meeting coffee walk garden project idea read book family dinner "
+    "travel plan write code review bug fix music run tired happy weekend call"
+).split()
+TAGS = ["work", "home", "health", "ideas", "travel", "urgent", "done", "family"]
+
+
+def generate_entries(count, seed=0, memo_words=(5, 30), tag_count=None, tag_skew=0.0):
+    """
+    Generate synthetic journal entry dictionaries.
+
+    Entries are spread evenly over about four years from 2020, and carry up to three
+    tags each.
+
+    :param count: The number of entries to generate.
+    :type count: int
+    :param seed: Optional. The random seed, so runs are reproducible.
+    :type seed: int
+    :param memo_words: Optional. The fewest and most words in a memo. Default is (5, 30).
+    :type memo_words: tuple
+    :param tag_count: Optional. How many distinct tags to draw from. Default is the
+        eight tags in TAGS; otherwise the tags are named tag0, tag1 and so on.
+    :type tag_count: int
+    :param tag_skew: Optional. The exponent of a Zipf distribution over the tags, so
+        that tag number n is used in proportion to 1 / (n + 1) ** tag_skew. Default is
+        0, which uses every tag equally.
+    :type tag_skew: float
+
+    :return: A generator of journal entry dictionaries with IDs 1 to count.
+    :rtype: generator
+    """
+    rng = random.Random(seed)
+    first_day = datetime.date(2020, 1, 1).toordinal()
+    tags = TAGS if tag_count is None else [f"tag{number}" for number in range(tag_count)]
+    weights = [1 / (rank + 1) ** tag_skew for rank in range(len(tags))]
+    shortest, longest = memo_words
+    for journal_id in range(1, count + 1):
+        memo = " ".join(rng.choices(WORDS, k=rng.randint(shortest, longest)))
+        size = rng.randint(0, min(3, len(tags)))
+        if tag_skew:
+            # Duplicates are dropped, so popular tags don't appear twice on an entry
+            chosen = list(dict.fromkeys(rng.choices(tags, weights, k=size)))
+        else:
+            chosen = rng.sample(tags, size)
+        yield {
+            "memo": memo,
+            "tags": chosen,
+            "creation_date": datetime.date.fromordinal(
+                first_day + journal_id * 1500 // count
+            ).isoformat(),
+            "id": journal_id,
+        }
+
+
+def write_book(path, count, seed=0, **options):
+    """
+    Write a synthetic JSON journal.
+
+    :param path: The path of the snapshot to write.
+    :type path: str
+    :param count: The number of entries to write.
+    :type count: int
+    :param seed: Optional. The random seed.
+    :type seed: int
+    :param options: Optional. memo_words, tag_count and tag_skew, as for generate_entries.
+
+    :return: None
+    :rtype: None
+    """
+    JsonStorage(path).compact(generate_entries(count, seed, **options))
+
+
+def deep_size(obj, seen=None):
+    """
+    Estimate the memory used by an object and everything it refers to.
+
+    Containers, arrays, columnar structures and slotted objects are followed.
+    Objects reached more than once are only counted once.
+
+    :param obj: The object to measure.
+    :type obj: object
+
+    :return: The estimated size in bytes.
+    :rtype: int
+    """
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += deep_size(key, seen) + deep_size(value, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += deep_size(item, seen)
+    elif hasattr(obj, "__dict__"):
+        size += deep_size(vars(obj), seen)
+    for slot in getattr(type(obj), "__slots__", ()):
+        if hasattr(obj, slot):
+            size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def measure_memory(load):
+    """
+    Measure the memory held by whatever a function builds.
+
+    :param load: A function that builds and returns the object to measure.
+    :type load: callable
+
+    :return: The memory still allocated once load returns, and the peak while it ran, in bytes.
+    :rtype: tuple
+    """
+    gc.collect()
+    tracemalloc.start()
+    result = load()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def memory_benchmark(count):
+    """
+    Compare the memory used by a loaded book in each JournalBook mode.
+
+    Three cases are measured against the same synthetic book: the default mode,
+    columnar mode, and the default mode with every entry materialised as a Journal
+    object. Alongside the total, the size of the entry map and date index is reported
+    on its own, since that is the part columnar mode changes.
+
+    :param count: The number of entries in the synthetic book.
+    :type count: int
+
+    :return: One result dictionary per case.
+    :rtype: list
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "journal_entries.json")
+        write_book(path, count)
+        cases = {
+            "default": lambda: (JournalBook(path), None),
+            "columnar": lambda: (JournalBook(path, columnar=True), None),
+            "materialised": lambda: materialise(JournalBook(path)),
+        }
+        results = []
+        for mode, load in cases.items():
+            current, peak = measure_memory(load)
+            book, journals = load()
+            results.append(
+                {
+                    "mode": mode,
+                    "entries": count,
+                    "resident_bytes": current,
+                    "peak_bytes": peak,
+                    "entry_bytes": deep_size([book.journals_by_id, book.date_index, journals]),
+                }
+            )
+        return results
+
+
+def materialise(book):
+    """Load every entry of a book as a Journal object"""
+    return book, list(book.journals)
+
+
+def import_benchmark(count):
+    """
+    Time a bulk import of a synthetic JSONL file into an empty book.
+
+    The time covers reading and validating the file, indexing the entries and writing
+    them to storage.
+
+    :param count: The number of entries to import.
+    :type count: int
+
+    :return: The number of entries imported and the time taken, in seconds.
+    :rtype: tuple
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "import.jsonl")
+        with open(source, "w") as file:
+            for entry in generate_entries(count):
+                file.write(json.dumps(entry) + "\n")
+        book = JournalBook(os.path.join(directory, "journal_entries.json"))
+        start = time.perf_counter()
+        imported, _ = book.bulk_import(read_import_file(source))
+        elapsed = time.perf_counter() - start
+        book.close()
+        return imported, elapsed
+
+
+def load_benchmark(count, repeat=3):
+    """
+    Time opening a synthetic book saved in each on-disk format.
+
+    Each load streams the snapshot and rebuilds the tag and date indexes, with the
+    keyword index read from its saved file. Rehydration is timed on its own too, by
+    turning every entry dictionary into a Journal with create_journal_from_dict.
+
+    As a baseline, "rehydrate old" turns the same dictionaries into Journals the way
+    create_journal_from_dict used to: parsing the date with strptime and calling the
+    Journal constructor, then putting back the stored date and ID. The "rehydrate"
+    result has a "speedup" over it.
+
+    :param count: The number of entries in the synthetic book.
+    :type count: int
+    :param repeat: Optional. How many times to time each case. Default is 3.
+    :type repeat: int
+
+    :return: One result dictionary per case, with the fastest time in seconds.
+    :rtype: list
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        json_path = os.path.join(directory, "journal_entries.json")
+        binary_path = os.path.join(directory, "journal_entries.bin")
+        write_book(json_path, count)
+        book = JournalBook(json_path)
+        # Save the keyword index, so both formats load it rather than rebuilding it
+        book.save_entries()
+        migrate_storage(json_path, binary_path)
+        entries = [entry for entry, _ in JsonStorage(json_path).iter_entries()]
+
+        def rehydrate():
+            for entry in entries:
+                book.create_journal_from_dict(entry)
+
+        def rehydrate_old():
+            last_id = Journal.last_id
+            for entry in entries:
+                creation_date = datetime.datetime.strptime(
+                    entry.get("creation_date", ""), "%Y-%m-%d"
+                ).date()
+                journal = Journal(entry.get("memo", ""), entry.get("tags", []))
+                journal.creation_date = creation_date
+                journal.id = entry.get("id", 0)
+            Journal.last_id = last_id
+
+        cases = {
+            "rehydrate old": rehydrate_old,
+            "rehydrate": rehydrate,
+            "load json": lambda: JournalBook(json_path).close(),
+            "load binary": lambda: JournalBook(binary_path).close(),
+        }
+        results = []
+        for case, operation in cases.items():
+            seconds = min(time_runs(operation, repeat))
+            results.append(
+                {
+                    "case": case,
+                    "entries": count,
+                    "seconds": seconds,
+                    "entries_per_second": count / seconds,
+                }
+            )
+        baseline, rehydrated = results[0], results[1]
+        rehydrated["speedup"] = baseline["seconds"] / rehydrated["seconds"]
+        book.close()
+        return results
+
+
+def check_pairs(entries):
+    """
+    Check that a view of the stress test's book is consistent.
+
+    :param entries: The journal entry dictionaries in the view.
+    :type entries: iterable
+
+    :return: A description of each pair that is broken in the view.
+    :rtype: list
+    """
+    memos = {}
+    for entry in entries:
+        memos.setdefault(entry["tags"][0], []).append(entry["memo"])
+    return [
+        f"{tag} has memos {found}"
+        for tag, found in memos.items()
+        if len(found) != 2 or found[0] != found[1]
+    ]
+
+
+def stress_test(writers=4, duration=5.0, pairs=500, seed=0):
+    """
+    Take backups and snapshots of a JournalBook while other threads edit it.
+
+    Entries come in pairs that share a tag, and writers only ever change both entries
+    of a pair at once while holding the book's lock: they give both the same new memo,
+    delete both, or add a new pair. In any consistent view of the book, then, every
+    pair tag has exactly two entries with the same memo. A reader thread takes backups
+    and opens snapshots throughout, and checks every one of them against that rule.
+
+    :param writers: Optional. The number of writer threads. Default is 4.
+    :type writers: int
+    :param duration: Optional. How long to run for, in seconds. Default is 5.
+    :type duration: float
+    :param pairs: Optional. The number of pairs to start with. Default is 500.
+    :type pairs: int
+    :param seed: Optional. The random seed.
+    :type seed: int
+
+    :return: The number of writes, backups and snapshots, and a list of the
+        inconsistencies found, which should be empty.
+    :rtype: dict
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        book = JournalBook(
+            os.path.join(directory, "journal_entries.json"), background_writes=True
+        )
+        live = {}
+
+        def add_pair(key):
+            with book.lock:
+                book.new_journal("version 0", [f"pair{key}"])
+                book.new_journal("version 0", [f"pair{key}"])
+                live[key] = (Journal.last_id - 1, Journal.last_id)
+
+        for key in range(pairs):
+            add_pair(key)
+
+        stop = threading.Event()
+        counts = {"writes": 0, "backups": 0, "snapshots": 0}
+        problems = []
+
+        def write(rng):
+            next_key = pairs
+            while not stop.is_set():
+                with book.lock:
+                    key = rng.choice(list(live))
+                    action = rng.random()
+                    if action < 0.7:
+                        memo = f"version {rng.random()}"
+                        for journal_id in live[key]:
+                            book.update_journal(journal_id, memo, [f"pair{key}"])
+                    elif action < 0.85 and len(live) > 1:
+                        for journal_id in live.pop(key):
+                            book.delete_journal(journal_id)
+                    else:
+                        next_key += 1
+                        add_pair(f"{rng.random()}-{next_key}")
+                    counts["writes"] += 1
+
+        def read():
+            backups = os.path.join(directory, "backups")
+            while not stop.is_set():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    record = book.perform_backup(backups)
+                if record is not None:
+                    entries = BackupManager(backups).restore_entries(record["name"])
+                    problems.extend(
+                        f"backup {record['name']}: {problem}"
+                        for problem in check_pairs(entries)
+                    )
+                    counts["backups"] += 1
+                with book.open_snapshot() as snapshot:
+                    entries = list(snapshot.entries())
+                problems.extend(f"snapshot: {problem}" for problem in check_pairs(entries))
+                counts["snapshots"] += 1
+
+        threads = [
+            threading.Thread(target=write, args=(random.Random(seed + number),))
+            for number in range(writers)
+        ]
+        threads.append(threading.Thread(target=read))
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        book.close()
+        with book.open_snapshot() as snapshot:
+            problems.extend(f"final: {problem}" for problem in check_pairs(snapshot.entries()))
+        counts["problems"] = problems
+        return counts
+
+
+def time_runs(operation, repeat):
+    """
+    Time an operation several times.
+
+    :param operation: The function to time. It is called with no arguments.
+    :type operation: callable
+    :param repeat: How many times to run it.
+    :type repeat: int
+
+    :return: The time each run took, in seconds.
+    :rtype: list
+    """
+    runs = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        operation()
+        runs.append(time.perf_counter() - start)
+    return runs
+
+
+def suite_operations(book, directory, sample):
+    """
+    List the JournalBook operations timed by the benchmark suite.
+
+    The operations are run in the order listed. The ones that change the book come
+    last, so the searches and exports all see the book as it was generated.
+
+    :param book: The loaded book.
+    :type book: JournalBook
+    :param directory: A scratch directory for exports and backups.
+    :type directory: str
+    :param sample: An entry from the book, to take search terms from.
+    :type sample: dict
+
+    :return: (name, operation, count) triples, where count is how many times the
+        operation is performed in one run.
+    :rtype: list
+    """
+    tag = sample["tags"][0] if sample["tags"] else TAGS[0]
+    word = sample["memo"].split()[0]
+    middle = datetime.date.fromisoformat(sample["creation_date"])
+    start_date = middle - datetime.timedelta(days=15)
+    end_date = middle + datetime.timedelta(days=15)
+    backups = os.path.join(directory, "backups")
+    operations = [
+        ("load_entries", book.load_entries, 1),
+        ("search_journal[index]", lambda: book.search_journal(word), 1),
+        ("search_journal[substring]", lambda: book.search_journal(word[1:], "substring"), 1),
+        ("search_journal[ranked]", lambda: book.search_journal(word, "ranked"), 1),
+        ("search_journal[regex]", lambda: book.search_journal(f"^{word}\\b", "regex"), 1),
+        ("fuzzy_search", lambda: book.fuzzy_search(word[:-1] + "x"), 1),
+        ("search_by_date", lambda: book.search_by_date(start_date, end_date), 1),
+        ("search_by_tags", lambda: book.search_by_tags([tag]), 1),
+        ("query_tags", lambda: book.query_tags(f"{tag} AND NOT {TAGS[-1]}"), 1),
+        ("fuzzy_search_by_tags", lambda: book.fuzzy_search_by_tags([tag + "x"]), 1),
+    ]
+    for file_format in ("json", "jsonl", "csv", "txt"):
+        operations.append(
+            (
+                f"export_entries[{file_format}]",
+                lambda file_format=file_format: book.export_entries(
+                    f"export.{file_format}", file_format, directory
+                ),
+                1,
+            )
+        )
+    operations += [
+        ("perform_backup[full]", lambda: book.perform_backup(backups, full=True), 1),
+        ("new_journal", lambda: [book.new_journal(word, [tag]) for _ in range(100)], 100),
+        ("perform_backup[incremental]", lambda: book.perform_backup(backups), 1),
+        ("save_entries", book.save_entries, 1),
+    ]
+    return operations
+
+
+def suite_benchmark(sizes, repeat=3, seed=0, operations=None, **options):
+    """
+    Time the main JournalBook operations on synthetic books of several sizes.
+
+    A book of each size is generated and loaded, then every operation is timed
+    repeat times. The query cache is turned off, so repeated searches do the full
+    work each time. Output from the operations is discarded.
+
+    :param sizes: The numbers of entries to test with.
+    :type sizes: list
+    :param repeat: Optional. How many times to time each operation. Default is 3.
+    :type repeat: int
+    :param seed: Optional. The random seed.
+    :type seed: int
+    :param operations: Optional. The names of the operations to time, as listed by
+        suite_operations. Default is all of them.
+    :type operations: list
+    :param options: Optional. memo_words, tag_count and tag_skew, as for generate_entries.
+
+    :return: A report with the settings and environment of the run under "meta", and
+        one result per size and operation under "results", each giving the time of
+        every run, the best and median times, and the best time per operation.
+    :rtype: dict
+    """
+    results = []
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "journal_entries.json")
+            write_book(path, size, seed, **options)
+            start = time.perf_counter()
+            book = JournalBook(path, cache_size=0)
+            opened = time.perf_counter() - start
+            sample = book.get_entry_dict(next(iter(book.journals_by_id)))
+            for name, operation, count in suite_operations(book, directory, sample):
+                if operations and name not in operations:
+                    continue
+                with contextlib.redirect_stdout(io.StringIO()):
+                    runs = time_runs(operation, repeat)
+                runs_sorted = sorted(runs)
+                results.append(
+                    {
+                        "entries": size,
+                        "operation": name,
+                        "runs": runs,
+                        "best": runs_sorted[0],
+                        "median": runs_sorted[len(runs) // 2],
+                        "per_operation": runs_sorted[0] / count,
+                    }
+                )
+            book.close()
+            results.append(
+                {
+                    "entries": size,
+                    "operation": "open",
+                    "runs": [opened],
+                    "best": opened,
+                    "median": opened,
+                    "per_operation": opened,
+                }
+            )
+    return {
+        "meta": {
+            "created": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "sizes": list(sizes),
+            "repeat": repeat,
+            "seed": seed,
+            "options": {key: value for key, value in options.items() if value is not None},
+        },
+        "results": results,
+    }
+
+
+def compare_reports(old, new, threshold=0.1):
+    """
+    Compare two benchmark suite reports.
+
+    :param old: The earlier report.
+    :type old: dict
+    :param new: The later report.
+    :type new: dict
+    :param threshold: Optional. How much slower, as a fraction, counts as a
+        regression. Default is 0.1.
+    :type threshold: float
+
+    :return: One (entries, operation, old best, new best, change) tuple per result in
+        both reports, where change is the fractional change in the best time, and a
+        list of the tuples that are regressions.
+    :rtype: tuple
+    """
+    before = {(result["entries"], result["operation"]): result for result in old["results"]}
+    rows = []
+    for result in new["results"]:
+        previous = before.get((result["entries"], result["operation"]))
+        if previous is None:
+            continue
+        change = result["best"] / previous["best"] - 1 if previous["best"] else 0.0
+        rows.append(
+            (result["entries"], result["operation"], previous["best"], result["best"], change)
+        )
+    return rows, [row for row in rows if row[4] > threshold]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for Scribe's JournalBook")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    memory_parser = subparsers.add_parser(
+        "memory", help="compare the memory used by each JournalBook mode"
+    )
+    memory_parser.add_argument("--entries", type=int, default=100000)
+    import_parser = subparsers.add_parser(
+        "import", help="measure bulk import throughput"
+    )
+    import_parser.add_argument("--entries", type=int, default=200000)
+    load_parser = subparsers.add_parser(
+        "load", help="time loading a book in each on-disk format"
+    )
+    load_parser.add_argument("--entries", type=int, default=200000)
+    load_parser.add_argument("--repeat", type=int, default=3)
+    stress_parser = subparsers.add_parser(
+        "stress", help="check backups stay consistent while entries are being edited"
+    )
+    stress_parser.add_argument("--writers", type=int, default=4)
+    stress_parser.add_argument("--seconds", type=float, default=5.0)
+    suite_parser = subparsers.add_parser(
+        "suite", help="time every main operation and write the results as JSON"
+    )
+    suite_parser.add_argument(
+        "--sizes",
+        default="1000,10000,100000",
+        help="comma-separated book sizes, such as 1000,10000,1000000,10000000",
+    )
+    suite_parser.add_argument("--repeat", type=int, default=3)
+    suite_parser.add_argument("--seed", type=int, default=0)
+    suite_parser.add_argument("--memo-words", type=int, nargs=2, default=(5, 30))
+    suite_parser.add_argument("--tags", type=int, help="number of distinct tags")
+    suite_parser.add_argument(
+        "--tag-skew", type=float, default=0.0, help="Zipf exponent of tag popularity"
+    )
+    suite_parser.add_argument(
+        "--only", action="append", help="time only this operation (can be repeated)"
+    )
+    suite_parser.add_argument("--output", help="write the JSON here instead of stdout")
+    compare_parser = subparsers.add_parser(
+        "compare", help="compare two suite results and list regressions"
+    )
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    if args.command == "memory":
+        print(
+            f"{'mode':<14}{'resident MB':>14}{'peak MB':>12}{'entries MB':>13}{'bytes/entry':>14}"
+        )
+        for result in memory_benchmark(args.entries):
+            print(
+                f"{result['mode']:<14}"
+                f"{result['resident_bytes'] / 1e6:>14.1f}"
+                f"{result['peak_bytes'] / 1e6:>12.1f}"
+                f"{result['entry_bytes'] / 1e6:>13.1f}"
+                f"{result['entry_bytes'] / result['entries']:>14.0f}"
+            )
+    elif args.command == "import":
+        imported, elapsed = import_benchmark(args.entries)
+        print(
+            f"Imported {imported} entries in {elapsed:.2f}s "
+            f"({imported / elapsed:,.0f} entries/s)"
+        )
+    elif args.command == "load":
+        print(f"{'case':<14}{'seconds':>10}{'entries/s':>14}{'vs old':>9}")
+        for result in load_benchmark(args.entries, args.repeat):
+            speedup = f"{result['speedup']:.1f}x" if "speedup" in result else ""
+            print(
+                f"{result['case']:<14}{result['seconds']:>10.3f}"
+                f"{result['entries_per_second']:>14,.0f}{speedup:>9}"
+            )
+    elif args.command == "stress":
+        result = stress_test(args.writers, args.seconds)
+        print(
+            f"{result['writes']} writes, {result['backups']} backups, "
+            f"{result['snapshots']} snapshots"
+        )
+        for problem in result["problems"]:
+            print(problem)
+        print(f"{len(result['problems'])} inconsistencies found")
+    elif args.command == "suite":
+        report = suite_benchmark(
+            [int(size) for size in args.sizes.split(",")],
+            args.repeat,
+            args.seed,
+            args.only,
+            memo_words=tuple(args.memo_words),
+            tag_count=args.tags,
+            tag_skew=args.tag_skew,
+        )
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(report, file, indent=4)
+        else:
+            print(json.dumps(report, indent=4))
+    elif args.command == "compare":
+        with open(args.old) as file:
+            old = json.load(file)
+        with open(args.new) as file:
+            new = json.load(file)
+        rows, regressions = compare_reports(old, new, args.threshold)
+        print(f"{'entries':>10}  {'operation':<30}{'old ms':>12}{'new ms':>12}{'change':>9}")
+        for entries, operation, before, after, change in rows:
+            print(
+                f"{entries:>10}  {operation:<30}{before * 1000:>12.2f}"
+                f"{after * 1000:>12.2f}{change:>+9.0%}"
+            )
+        print(f"{len(regressions)} regressions over {args.threshold:.0%}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
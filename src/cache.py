@@ -0,0 +1,183 @@
+from collections import OrderedDict
+
+from indexes import normalize
+
+
+class QueryCache:
+    """
+    Keep the results of recent searches, and drop only those a change could affect.
+
+    Results are kept in least-recently-used order up to a fixed number of queries.
+    Each result is stored with what it depends on: the words, tags and date range of
+    its query. When a journal entry is added, edited or deleted, only the results that
+    share a word or tag with the entry, or whose date range covers its date, are
+    dropped. Results that depend on the whole book, such as ranked or substring
+    searches, are dropped on any change.
+
+    Every change also bumps a version counter, reported with the hit and miss counts
+    by stats.
+    """
+
+    def __init__(self, capacity=256):
+        """
+        Initialise the cache.
+
+        :param capacity: Optional. The most results to keep. 0 turns the cache off.
+            Default is 256.
+        :type capacity: int
+        """
+        self.capacity = capacity
+        self.results = OrderedDict()
+        # Query key -> (words, tags, date range, depends on everything)
+        self.dependencies = {}
+        self.keys_by_word = {}
+        self.keys_by_tag = {}
+        self.date_keys = set()
+        self.global_keys = set()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Look up the result of a query.
+
+        :param key: The normalised query.
+        :type key: tuple
+
+        :return: The cached result, or None if it isn't cached.
+        :rtype: object
+        """
+        result = self.results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.results.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key, result, words=(), tags=(), date_range=None, everything=False):
+        """
+        Cache the result of a query.
+
+        :param key: The normalised query.
+        :type key: tuple
+        :param result: The result. It must not be modified afterwards.
+        :type result: object
+        :param words: Optional. The words the result depends on.
+        :type words: iterable
+        :param tags: Optional. The tags the result depends on.
+        :type tags: iterable
+        :param date_range: Optional. The (start, end) dates the result depends on.
+        :type date_range: tuple
+        :param everything: Optional. Whether any change to the book can affect the result.
+        :type everything: bool
+
+        :return: None
+        :rtype: None
+        """
+        if self.capacity <= 0:
+            return
+        self.discard(key)
+        words = {normalize(word) for word in words}
+        tags = set(tags)
+        self.results[key] = result
+        self.dependencies[key] = (words, tags, date_range, everything)
+        for word in words:
+            self.keys_by_word.setdefault(word, set()).add(key)
+        for tag in tags:
+            self.keys_by_tag.setdefault(tag, set()).add(key)
+        if date_range is not None:
+            self.date_keys.add(key)
+        if everything:
+            self.global_keys.add(key)
+        while len(self.results) > self.capacity:
+            self.discard(next(iter(self.results)))
+            self.evictions += 1
+
+    def discard(self, key):
+        """
+        Drop a query's result, if it is cached.
+
+        :param key: The normalised query.
+        :type key: tuple
+
+        :return: None
+        :rtype: None
+        """
+        if self.results.pop(key, None) is None:
+            return
+        words, tags, _, _ = self.dependencies.pop(key)
+        for word in words:
+            keys = self.keys_by_word[word]
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_word[word]
+        for tag in tags:
+            keys = self.keys_by_tag[tag]
+            keys.discard(key)
+            if not keys:
+                del self.keys_by_tag[tag]
+        self.date_keys.discard(key)
+        self.global_keys.discard(key)
+
+    def invalidate(self, words, tags, creation_date):
+        """
+        Drop the results a change to a journal entry could affect.
+
+        Call this with the entry as it was before the change and again as it is after.
+
+        :param words: The entry's words.
+        :type words: iterable
+        :param tags: The entry's tags.
+        :type tags: iterable
+        :param creation_date: The entry's creation date.
+        :type creation_date: datetime.date
+
+        :return: None
+        :rtype: None
+        """
+        self.version += 1
+        if not self.results:
+            return
+        stale = set(self.global_keys)
+        for word in {normalize(word) for word in words}:
+            stale |= self.keys_by_word.get(word, set())
+        for tag in tags:
+            stale |= self.keys_by_tag.get(tag.strip(), set())
+        for key in self.date_keys:
+            start, end = self.dependencies[key][2]
+            if start <= creation_date <= end:
+                stale.add(key)
+        for key in stale:
+            self.discard(key)
+        self.invalidations += len(stale)
+
+    def clear(self):
+        """Drop every cached result, for changes too large to track one by one"""
+        self.version += 1
+        self.invalidations += len(self.results)
+        for key in list(self.results):
+            self.discard(key)
+
+    def stats(self):
+        """
+        Report how well the cache is working.
+
+        :return: The number of hits, misses, evictions and invalidated results, the
+            hit rate, the number of results cached, the capacity and the version.
+        :rtype: dict
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "size": len(self.results),
+            "capacity": self.capacity,
+            "version": self.version,
+        }
@@ -0,0 +1,278 @@
+import bisect
+from array import array
+
+
+class ColumnarEntries:
+    """
+    Hold a JournalBook's saved entries in array-backed columns.
+
+    This is a drop-in replacement for the journals_by_id dictionary. Saved entries
+    take one row each in three arrays (ID, offset and length), around 20 bytes an
+    entry, instead of a dictionary slot and a location tuple. Rows are kept in ID
+    order and found by binary search. Deleted rows are left as tombstones until the
+    next compaction rebuilds the columns.
+
+    Journal objects that have been added or edited since the last compaction, and
+    any location that can't be appended in ID order, live in a small overlay
+    dictionary that shadows the columns.
+    """
+
+    DELETED = -1
+
+    def __init__(self, items=()):
+        """
+        Initialise the columns.
+
+        :param items: Optional. (journal_id, value) pairs, as for dict.
+        :type items: iterable, optional
+        """
+        self.ids = array("q")
+        self.offsets = array("q")
+        # A length of 0 marks a location that is a single integer, such as a SQLite row ID
+        self.lengths = array("l")
+        self.overlay = {}
+        self.count = 0
+        for journal_id, value in items:
+            self[journal_id] = value
+
+    def find_row(self, journal_id):
+        """
+        Find the row holding a journal ID.
+
+        :param journal_id: The ID to look up.
+        :type journal_id: int
+
+        :return: The row number, or None if the ID has no live row.
+        :rtype: int or None
+        """
+        row = bisect.bisect_left(self.ids, journal_id)
+        if (
+            row < len(self.ids)
+            and self.ids[row] == journal_id
+            and self.lengths[row] != self.DELETED
+        ):
+            return row
+        return None
+
+    def row_value(self, row):
+        """
+        Rebuild the storage location held in a row.
+
+        :param row: The row number.
+        :type row: int
+
+        :return: The location, as it was stored.
+        :rtype: tuple or int
+        """
+        if self.lengths[row] == 0:
+            return self.offsets[row]
+        return (self.offsets[row], self.lengths[row])
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, journal_id):
+        return journal_id in self.overlay or self.find_row(journal_id) is not None
+
+    def __getitem__(self, journal_id):
+        value = self.get(journal_id)
+        if value is None:
+            raise KeyError(journal_id)
+        return value
+
+    def get(self, journal_id, default=None):
+        """
+        Look up the value for a journal ID.
+
+        :param journal_id: The ID to look up.
+        :type journal_id: int
+        :param default: Optional. What to return if the ID isn't present.
+        :type default: object, optional
+
+        :return: The Journal or storage location, or default.
+        :rtype: object
+        """
+        if journal_id in self.overlay:
+            return self.overlay[journal_id]
+        row = self.find_row(journal_id)
+        if row is None:
+            return default
+        return self.row_value(row)
+
+    def __setitem__(self, journal_id, value):
+        if journal_id not in self:
+            self.count += 1
+        if isinstance(value, (tuple, int)) and (
+            not self.ids or journal_id > self.ids[-1]
+        ):
+            self.ids.append(journal_id)
+            if isinstance(value, tuple):
+                self.offsets.append(value[0])
+                self.lengths.append(value[1])
+            else:
+                self.offsets.append(value)
+                self.lengths.append(0)
+            self.overlay.pop(journal_id, None)
+        else:
+            self.overlay[journal_id] = value
+
+    def pop(self, journal_id, default=None):
+        """
+        Remove a journal ID and return its value.
+
+        :param journal_id: The ID to remove.
+        :type journal_id: int
+        :param default: Optional. What to return if the ID isn't present.
+        :type default: object, optional
+
+        :return: The Journal or storage location that was removed, or default.
+        :rtype: object
+        """
+        value = self.overlay.pop(journal_id, None)
+        row = self.find_row(journal_id)
+        if row is not None:
+            if value is None:
+                value = self.row_value(row)
+            self.lengths[row] = self.DELETED
+        if value is None:
+            return default
+        self.count -= 1
+        return value
+
+    def __iter__(self):
+        for row, journal_id in enumerate(self.ids):
+            if self.lengths[row] != self.DELETED:
+                yield journal_id
+        for journal_id in self.overlay:
+            if self.find_row(journal_id) is None:
+                yield journal_id
+
+    def __reversed__(self):
+        for journal_id in reversed(
+            [journal_id for journal_id in self.overlay if self.find_row(journal_id) is None]
+        ):
+            yield journal_id
+        for row in range(len(self.ids) - 1, -1, -1):
+            if self.lengths[row] != self.DELETED:
+                yield self.ids[row]
+
+    def keys(self):
+        """Iterate over the journal IDs in order"""
+        return iter(self)
+
+    def values(self):
+        """Iterate over the Journals and storage locations in ID order"""
+        return (self.get(journal_id) for journal_id in self)
+
+    def items(self):
+        """Iterate over (journal ID, value) pairs in ID order"""
+        return ((journal_id, self.get(journal_id)) for journal_id in self)
+
+
+class ColumnarDateIndex:
+    """
+    Keep journal IDs sorted by creation date in two parallel arrays.
+
+    This has the same interface as indexes.DateIndex, but stores ordinal dates and
+    IDs as machine integers rather than a list of tuples.
+    """
+
+    def __init__(self, entries=()):
+        """
+        Initialise the index.
+
+        :param entries: Optional. (creation_date, journal_id) pairs to index.
+        :type entries: iterable, optional
+        """
+        keys = sorted(
+            (creation_date.toordinal(), journal_id)
+            for creation_date, journal_id in entries
+        )
+        self.ordinals = array("l", (ordinal for ordinal, _ in keys))
+        self.ids = array("q", (journal_id for _, journal_id in keys))
+
+    def find(self, ordinal, journal_id):
+        """
+        Find where an (ordinal, ID) key belongs.
+
+        :return: The position of the key, or where it would be inserted.
+        :rtype: int
+        """
+        position = bisect.bisect_left(self.ordinals, ordinal)
+        end = bisect.bisect_right(self.ordinals, ordinal, position)
+        return position + bisect.bisect_left(self.ids[position:end], journal_id)
+
+    def add(self, journal_id, creation_date):
+        """
+        Add a journal to the index.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+        :param creation_date: The creation date of the journal entry.
+        :type creation_date: datetime.date
+
+        :return: None
+        :rtype: None
+        """
+        ordinal = creation_date.toordinal()
+        position = self.find(ordinal, journal_id)
+        self.ordinals.insert(position, ordinal)
+        self.ids.insert(position, journal_id)
+
+    def add_many(self, entries):
+        """
+        Add many journals to the index at once, rebuilding the columns in one pass.
+
+        :param entries: (creation_date, journal_id) pairs to index.
+        :type entries: iterable
+
+        :return: None
+        :rtype: None
+        """
+        keys = list(zip(self.ordinals, self.ids))
+        keys.extend(
+            (creation_date.toordinal(), journal_id)
+            for creation_date, journal_id in entries
+        )
+        keys.sort()
+        self.ordinals = array("l", (ordinal for ordinal, _ in keys))
+        self.ids = array("q", (journal_id for _, journal_id in keys))
+
+    def remove(self, journal_id, creation_date):
+        """
+        Remove a journal from the index.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+        :param creation_date: The creation date the journal entry was indexed under.
+        :type creation_date: datetime.date
+
+        :return: None
+        :rtype: None
+        """
+        ordinal = creation_date.toordinal()
+        position = self.find(ordinal, journal_id)
+        if (
+            position < len(self.ids)
+            and self.ordinals[position] == ordinal
+            and self.ids[position] == journal_id
+        ):
+            del self.ordinals[position]
+            del self.ids[position]
+
+    def range(self, start_date, end_date):
+        """
+        Yield the IDs of journals created between two dates, inclusive.
+
+        :param start_date: Start date of the date range.
+        :type start_date: datetime.date
+        :param end_date: End date of the date range.
+        :type end_date: datetime.date
+
+        :return: A generator of journal IDs, in date order, then ID order.
+        :rtype: generator
+        """
+        start = bisect.bisect_left(self.ordinals, start_date.toordinal())
+        end = bisect.bisect_right(self.ordinals, end_date.toordinal())
+        for position in range(start, end):
+            yield self.ids[position]
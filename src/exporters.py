@@ -0,0 +1,137 @@
+import csv
+import gzip
+import io
+import json
+
+# Exported text is gathered into pieces of about this many characters before each write
+CHUNK_SIZE = 64 * 1024
+
+
+def json_chunks(entries):
+    """
+    Yield a JSON array of journal entries, one entry at a time.
+
+    The output matches json.dump(entries, file, indent=4), but only one entry is held
+    in memory at once.
+
+    :param entries: Journal entry dictionaries.
+    :type entries: iterable
+
+    :return: A generator of strings.
+    :rtype: generator
+    """
+    separator = "[\n"
+    for entry in entries:
+        yield separator
+        yield "    " + json.dumps(entry, indent=4).replace("\n", "\n    ")
+        separator = ",\n"
+    yield "[]" if separator == "[\n" else "\n]"
+
+
+def jsonl_chunks(entries):
+    """
+    Yield journal entries as JSON Lines, one entry per line.
+
+    :param entries: Journal entry dictionaries.
+    :type entries: iterable
+
+    :return: A generator of strings.
+    :rtype: generator
+    """
+    for entry in entries:
+        yield json.dumps(entry) + "\n"
+
+
+def csv_chunks(entries):
+    """
+    Yield journal entries as CSV rows, with a header row first.
+
+    :param entries: Journal entry dictionaries.
+    :type entries: iterable
+
+    :return: A generator of strings.
+    :rtype: generator
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["Memo", "Tags", "Creation Date"])
+    for entry in entries:
+        writer.writerow([entry["memo"], ", ".join(entry["tags"]), entry["creation_date"]])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def txt_chunks(entries):
+    """
+    Yield journal entries as readable text, separated by blank lines.
+
+    :param entries: Journal entry dictionaries.
+    :type entries: iterable
+
+    :return: A generator of strings.
+    :rtype: generator
+    """
+    for entry in entries:
+        yield f"Memo: {entry['memo']}\n"
+        if entry["tags"]:
+            yield f"Tags: {', '.join(entry['tags'])}\n"
+        yield f"Creation Date: {entry['creation_date']}\n\n"
+
+
+EXPORTERS = {
+    "json": json_chunks,
+    "jsonl": jsonl_chunks,
+    "csv": csv_chunks,
+    "txt": txt_chunks,
+}
+
+
+def write_export(path, entries, file_format="json", compress=False):
+    """
+    Stream journal entries to a file.
+
+    Entries are converted one at a time and written in chunks of about CHUNK_SIZE
+    characters, so memory use doesn't grow with the number of entries.
+
+    :param path: The file to write.
+    :type path: str
+    :param entries: Journal entry dictionaries, as produced by JournalBook.journal_to_dict.
+    :type entries: iterable
+    :param file_format: Optional. 'json', 'jsonl', 'csv' or 'txt'. Default is 'json'.
+    :type file_format: str
+    :param compress: Optional. Whether to gzip the file. Default is False.
+    :type compress: bool
+
+    :return: The number of entries written.
+    :rtype: int
+
+    :raises ValueError: If the file format isn't supported.
+    """
+    exporter = EXPORTERS.get(file_format)
+    if exporter is None:
+        raise ValueError(
+            "Unsupported file format. Supported formats are 'json', 'jsonl', 'csv', and 'txt'."
+        )
+    count = 0
+
+    def counted(entries):
+        nonlocal count
+        for entry in entries:
+            count += 1
+            yield entry
+
+    opener = gzip.open if compress else open
+    with opener(path, "wt", encoding="utf-8", newline="") as file:
+        pending = []
+        size = 0
+        for chunk in exporter(counted(entries)):
+            pending.append(chunk)
+            size += len(chunk)
+            if size >= CHUNK_SIZE:
+                file.write("".join(pending))
+                pending = []
+                size = 0
+        file.write("".join(pending))
+    return count
@@ -0,0 +1,413 @@
+import asyncio
+import json
+import re
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from server import JournalService
+
+# Requests with a larger body are refused
+MAX_BODY_SIZE = 1024 * 1024
+ENTRY_PATH = re.compile(r"^/entries/(\d+)$")
+
+
+class HttpError(Exception):
+    """An error to send back to the client with an HTTP status"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def query_int(query, name, default):
+    """
+    Read an integer from a query string.
+
+    :param query: The parsed query string.
+    :type query: dict
+    :param name: The parameter's name.
+    :type name: str
+    :param default: What to return if the parameter isn't given.
+    :type default: int or None
+
+    :return: The parameter's value, or None if it is 'all'.
+    :rtype: int or None
+
+    :raises HttpError: If the value isn't a whole number.
+    """
+    value = query.get(name, [None])[0]
+    if value is None:
+        return default
+    if value == "all":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise HttpError(HTTPStatus.BAD_REQUEST, f"{name} must be a whole number")
+
+
+def check_entry(data):
+    """
+    Check the memo and tags sent to add or replace an entry.
+
+    :param data: The decoded request body.
+    :type data: dict
+
+    :return: None
+    :rtype: None
+
+    :raises HttpError: If the memo isn't a string, or the tags aren't a string or a
+        list of strings.
+    """
+    if not isinstance(data.get("memo"), str):
+        raise HttpError(HTTPStatus.BAD_REQUEST, "memo is required")
+    tags = data.get("tags", [])
+    if not isinstance(tags, str) and not (
+        isinstance(tags, list) and all(isinstance(tag, str) for tag in tags)
+    ):
+        raise HttpError(
+            HTTPStatus.BAD_REQUEST, "tags must be a string or a list of strings"
+        )
+
+
+class JournalHttpServer:
+    """
+    Serve a JournalBook over HTTP with asyncio, using only the standard library.
+
+    The routes, all of which send and return JSON, are:
+
+    - GET /entries?offset=&limit=&order= lists a page of entries.
+    - POST /entries adds an entry from {"memo": ..., "tags": [...]}.
+    - GET, PUT and DELETE /entries/<id> read, replace and delete an entry.
+    - GET /search?q=&mode=&limit=&fold=&tags=&from=&to= searches, as JournalService.search.
+    - POST /export writes an export, with the parameters of JournalService.export.
+    - GET /stats reports JournalBook.stats, with the writer's commit counts.
+    - GET /metrics reports the same in the Prometheus text format, as plain text.
+
+    Reads run on a pool of threads, so they don't hold up the event loop. Entries
+    and searches are served from the book's ReadView, which is replaced after every
+    batch, so reads don't take the book's lock: they run side by side, and don't wait
+    while the writer applies a batch. Each read sees the book as it was after a whole
+    batch. Exports read through a snapshot, so they don't hold up writes either.
+    Writes are queued for a single writer task, which applies everything waiting in
+    the queue as one batch, with one commit to storage.
+    """
+
+    def __init__(self, journalbook, readers=8, max_batch=256):
+        """
+        Initialise the server.
+
+        :param journalbook: The journalbook to serve.
+        :type journalbook: JournalBook
+        :param readers: Optional. How many reads to run at once. Default is 8.
+        :type readers: int
+        :param max_batch: Optional. The most writes to commit together. Default is 256.
+        :type max_batch: int
+        """
+        self.journalbook = journalbook
+        self.service = JournalService(journalbook)
+        self.read_executor = ThreadPoolExecutor(readers)
+        self.write_executor = ThreadPoolExecutor(1)
+        self.max_batch = max_batch
+        self.writes = None
+        self.writes_committed = 0
+        self.batches_committed = 0
+
+    async def read(self, method, **params):
+        """Run a read on the reader threads"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.read_executor, lambda: method(**params)
+        )
+
+    async def write(self, method, **params):
+        """Queue a write for the writer task and wait for its result"""
+        future = asyncio.get_running_loop().create_future()
+        await self.writes.put((method, params, future))
+        return await future
+
+    async def run_writer(self):
+        """
+        Apply queued writes until cancelled.
+
+        Everything waiting in the queue when the writer is ready, up to max_batch
+        writes, is applied in one JournalBook.batch, so it costs a single commit.
+        Every write in a batch gets an answer, even if the batch fails as a whole, so
+        no request is left waiting and the writer keeps running.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.writes.get()]
+            while len(batch) < self.max_batch and not self.writes.empty():
+                batch.append(self.writes.get_nowait())
+            results = None
+            try:
+                results = await loop.run_in_executor(
+                    self.write_executor, self.apply_writes, batch
+                )
+            except Exception as error:
+                results = [(error, None)] * len(batch)
+            finally:
+                if results is None:
+                    # Cancelled because the server is stopping
+                    stopping = ConnectionAbortedError("The server is shutting down")
+                    results = [(stopping, None)] * len(batch)
+                for (_, _, future), (error, result) in zip(batch, results):
+                    if future.done():
+                        continue
+                    if error is not None:
+                        future.set_exception(error)
+                    else:
+                        future.set_result(result)
+
+    def apply_writes(self, batch):
+        """
+        Apply a batch of writes and commit them together.
+
+        Args:
+        batch (list): (method, params, future) triples.
+
+        Returns:
+        list: An (error, result) pair for each write, where error is None if the
+        write succeeded.
+        """
+        results = []
+        with self.journalbook.batch():
+            for method, params, _ in batch:
+                try:
+                    results.append((None, method(**params)))
+                except Exception as error:
+                    # Only this write fails; the rest of the batch is still committed
+                    results.append((error, None))
+        self.writes_committed += len(batch)
+        self.batches_committed += 1
+        return results
+
+    async def route(self, method, target, body):
+        """
+        Answer a request.
+
+        Args:
+        method (str): The HTTP method.
+        target (str): The request target, with any query string.
+        body (bytes): The request body.
+
+        Returns:
+        tuple: The HTTP status and the JSON-serialisable response.
+
+        Raises:
+        HttpError: If the request can't be answered.
+        """
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        data = {}
+        if body:
+            try:
+                data = json.loads(body)
+            except ValueError:
+                raise HttpError(HTTPStatus.BAD_REQUEST, "The body must be JSON")
+            if not isinstance(data, dict):
+                raise HttpError(HTTPStatus.BAD_REQUEST, "The body must be a JSON object")
+        service = self.service
+
+        if url.path == "/entries":
+            if method == "GET":
+                return HTTPStatus.OK, await self.read(
+                    service.list,
+                    offset=query_int(query, "offset", 0),
+                    limit=query_int(query, "limit", 10),
+                    order=query.get("order", ["asc"])[0],
+                )
+            if method == "POST":
+                check_entry(data)
+                entry = await self.write(
+                    service.add, memo=data["memo"], tags=data.get("tags", [])
+                )
+                return HTTPStatus.CREATED, entry
+            raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use GET or POST")
+
+        match = ENTRY_PATH.match(url.path)
+        if match:
+            journal_id = int(match.group(1))
+            if method == "GET":
+                entry = await self.read(service.get, id=journal_id)
+            elif method == "PUT":
+                check_entry(data)
+                entry = None
+                if await self.write(
+                    service.update,
+                    id=journal_id,
+                    memo=data["memo"],
+                    tags=data.get("tags", []),
+                ):
+                    entry = await self.read(service.get, id=journal_id)
+            elif method == "DELETE":
+                if await self.write(service.delete, id=journal_id):
+                    return HTTPStatus.OK, {"deleted": journal_id}
+                entry = None
+            else:
+                raise HttpError(HTTPStatus.METHOD_NOT_ALLOWED, "Use GET, PUT or DELETE")
+            if entry is None:
+                raise HttpError(HTTPStatus.NOT_FOUND, f"No entry with ID {journal_id}")
+            return HTTPStatus.OK, entry
+
+        if url.path == "/search" and method == "GET":
+            return HTTPStatus.OK, await self.read(
+                service.search,
+                query=query.get("q", [None])[0],
+                mode=query.get("mode", ["ranked"])[0],
+                limit=query_int(query, "limit", 10),
+                fold=query.get("fold", ["true"])[0].lower() != "false",
+                tags=query.get("tags", [None])[0],
+                start_date=query.get("from", [None])[0],
+                end_date=query.get("to", [None])[0],
+            )
+        if url.path == "/export" and method == "POST":
+            if not isinstance(data.get("filename"), str):
+                raise HttpError(HTTPStatus.BAD_REQUEST, "filename is required")
+            return HTTPStatus.OK, {"file": await self.read(service.export, **data)}
+        if url.path == "/stats" and method == "GET":
+            stats = await self.read(service.stats)
+            stats["writes"] = self.writes_committed
+            stats["write_batches"] = self.batches_committed
+            return HTTPStatus.OK, stats
+        if url.path == "/metrics" and method == "GET":
+            text = await self.read(self.journalbook.metrics_text)
+            text += (
+                "# TYPE scribe_http_writes_total counter\n"
+                f"scribe_http_writes_total {self.writes_committed}\n"
+                "# TYPE scribe_http_write_batches_total counter\n"
+                f"scribe_http_write_batches_total {self.batches_committed}\n"
+            )
+            return HTTPStatus.OK, text
+        raise HttpError(HTTPStatus.NOT_FOUND, f"No route for {method} {url.path}")
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answer HTTP/1.1 requests on a connection until the client closes it.
+
+        Connections are kept alive between requests unless the client asks otherwise.
+        """
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                    length = int(headers.get("content-length", 0))
+                except ValueError:
+                    await self.respond(
+                        writer, HTTPStatus.BAD_REQUEST, {"error": "Bad request"}, False
+                    )
+                    break
+                if length > MAX_BODY_SIZE:
+                    await self.respond(
+                        writer,
+                        HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                        {"error": "The body is too large"},
+                        False,
+                    )
+                    break
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, payload = await self.route(method.upper(), target, body)
+                except HttpError as error:
+                    status, payload = error.status, {"error": str(error)}
+                except (KeyError, TypeError, ValueError, re.error) as error:
+                    status, payload = HTTPStatus.BAD_REQUEST, {"error": str(error)}
+                except Exception as error:
+                    status = HTTPStatus.INTERNAL_SERVER_ERROR
+                    payload = {"error": str(error)}
+                keep_alive = (
+                    version == "HTTP/1.1"
+                    and headers.get("connection", "").lower() != "close"
+                )
+                await self.respond(writer, status, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, writer, status, payload, keep_alive):
+        """Send a response, as plain text if payload is a string and JSON otherwise"""
+        if isinstance(payload, str):
+            data = payload.encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            data = json.dumps(payload).encode("utf-8")
+            content_type = "application/json"
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + data)
+        await writer.drain()
+
+    async def serve(self, host="127.0.0.1", port=8765, ready=None):
+        """
+        Serve requests until cancelled.
+
+        Args:
+        host (str, optional): The address to listen on. Default is 127.0.0.1, which
+            only accepts connections from this computer.
+        port (int, optional): The port to listen on. Default is 8765.
+        ready (callable, optional): Called with the listening port once the server
+            is accepting connections.
+        """
+        self.writes = asyncio.Queue()
+        writer_task = asyncio.create_task(self.run_writer())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        if ready is not None:
+            ready(server.sockets[0].getsockname()[1])
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            self.read_executor.shutdown()
+            self.write_executor.shutdown()
+
+
+def run(journalbook, host="127.0.0.1", port=8765):
+    """
+    Serve a journalbook over HTTP until interrupted or terminated.
+
+    :param journalbook: The journalbook to serve.
+    :type journalbook: JournalBook
+    :param host: Optional. The address to listen on. Default is 127.0.0.1.
+    :type host: str
+    :param port: Optional. The port to listen on. Default is 8765.
+    :type port: int
+
+    :return: None
+    :rtype: None
+    """
+    server = JournalHttpServer(journalbook)
+    if threading.current_thread() is threading.main_thread():
+        # Treat SIGTERM like Ctrl+C, so the caller can close the journalbook
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        asyncio.run(
+            server.serve(
+                host,
+                port,
+                lambda port: print(f"Serving on http://{host}:{port}", flush=True),
+            )
+        )
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,786 @@
+import bisect
+import itertools
+import math
+import operator
+import re
+import unicodedata
+from collections import Counter
+
+TOKEN_PATTERN = re.compile(r"\w+")
+# Maps every ASCII byte that can't be part of a token to a space
+ASCII_SEPARATORS = bytes(
+    byte if chr(byte).isalnum() or chr(byte) == "_" else ord(" ")
+    for byte in range(128)
+) + b" " * 128
+PHRASE_PATTERN = re.compile(r'"([^"]*)"')
+
+# BM25 parameters: how quickly repeated terms stop adding to the score, and how much
+# long entries are penalised
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def tokenize(text):
+    """
+    Split text into word tokens.
+
+    Tokens are runs of letters, digits and underscores. Matching is case-sensitive,
+    in line with Journal.match.
+
+    ASCII text, the common case, is split without the regular expression: every
+    other character is translated to a space and the text split on whitespace,
+    which gives the same tokens two to three times faster.
+
+    :param text: The text to split.
+    :type text: str
+
+    :return: The tokens in the order they appear.
+    :rtype: list
+    """
+    if text.isascii():
+        return text.encode("ascii").translate(ASCII_SEPARATORS).decode("ascii").split()
+    return TOKEN_PATTERN.findall(text)
+
+
+def normalize(text):
+    """
+    Fold text for case-insensitive matching.
+
+    Text is case-folded and accents are removed, so "Café" and "cafe" compare equal.
+
+    :param text: The text to fold.
+    :type text: str
+
+    :return: The folded text.
+    :rtype: str
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return "".join(char for char in text if not unicodedata.combining(char))
+
+
+def parse_search_query(query):
+    """
+    Split a search query into words and quoted phrases.
+
+    :param query: The query text, for example 'coffee "morning walk"'.
+    :type query: str
+
+    :return: The tokens of every word and phrase, and a list of the tokens of each
+        phrase.
+    :rtype: tuple
+    """
+    phrases = [tokenize(phrase) for phrase in PHRASE_PATTERN.findall(query)]
+    phrases = [phrase for phrase in phrases if phrase]
+    return tokenize(query), phrases
+
+
+def journal_tokens(journal):
+    """
+    Collect the tokens in a journal's memo and tags.
+
+    :param journal: The journal entry to tokenize.
+    :type journal: Journal
+
+    :return: The tokens, including repeats.
+    :rtype: list
+    """
+    return entry_tokens(journal.memo, journal.tags)
+
+
+def entry_tokens(memo, tags):
+    """
+    Collect the tokens in a memo and list of tags.
+
+    :param memo: The memo text.
+    :type memo: str
+    :param tags: The tags.
+    :type tags: iterable
+
+    :return: The tokens, including repeats.
+    :rtype: list
+    """
+    # Spaces can't appear inside a token, so one pass over the joined text is enough
+    return tokenize(" ".join((memo, *tags)))
+
+
+class InvertedIndex:
+    """
+    Map each token to the set of journal IDs whose memo or tags contain it.
+
+    Alongside the postings the index keeps what BM25 ranking needs: how many times a
+    token appears in each journal, recorded only where it appears more than once, and
+    the number of tokens in each journal.
+    """
+
+    def __init__(self, postings=None, counts=None, lengths=None):
+        """
+        Initialise the index.
+
+        :param postings: Optional. An existing mapping of token to a set of journal IDs.
+        :type postings: dict, optional
+        :param counts: Optional. A mapping of token to {journal ID: count} for the
+            journals that contain the token more than once.
+        :type counts: dict, optional
+        :param lengths: Optional. A mapping of journal ID to its number of tokens.
+        :type lengths: dict, optional
+        """
+        self.postings = postings if postings is not None else {}
+        self.counts = counts if counts is not None else {}
+        self.lengths = lengths if lengths is not None else {}
+        self.total_length = sum(self.lengths.values())
+        # Folded token -> the tokens that fold to it, built on first use
+        self.folded = None
+
+    def add(self, journal_id, tokens):
+        """
+        Add a journal's tokens to the index.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+        :param tokens: The tokens in the journal entry, including repeats.
+        :type tokens: list
+
+        :return: None
+        :rtype: None
+        """
+        self.add_many(((journal_id, tokens),))
+
+    def add_many(self, entries):
+        """
+        Add many journals to the index at once.
+
+        The IDs are grouped by token first, so each posting set is updated once per
+        call rather than once per journal. A token repeated within a journal is
+        grouped once per occurrence, so the repeats sit next to each other and are
+        counted afterwards, per token, rather than in the loop over every token.
+
+        :param entries: (journal_id, tokens) pairs to index.
+        :type entries: iterable
+
+        :return: None
+        :rtype: None
+        """
+        grouped = {}
+        # Bound to locals, as this loop runs once for every token of a bulk import
+        find = grouped.get
+        lengths = self.lengths
+        total_length = 0
+        for journal_id, tokens in entries:
+            lengths[journal_id] = len(tokens)
+            total_length += len(tokens)
+            for token in tokens:
+                ids = find(token)
+                if ids is None:
+                    grouped[token] = [journal_id]
+                else:
+                    ids.append(journal_id)
+        self.total_length += total_length
+        for token, ids in grouped.items():
+            unique = set(ids)
+            if len(unique) != len(ids):
+                # Each ID equal to the one before it is a repeat within that journal
+                repeats = Counter(itertools.compress(ids, map(operator.eq, ids, ids[1:])))
+                counts = self.counts.get(token)
+                if counts is None:
+                    counts = self.counts[token] = {}
+                for journal_id, extra in repeats.items():
+                    counts[journal_id] = extra + 1
+            postings = self.postings.get(token)
+            if postings is None:
+                self.postings[token] = unique
+                if self.folded is not None:
+                    self.folded.setdefault(normalize(token), set()).add(token)
+            else:
+                postings.update(unique)
+
+    def remove(self, journal_id, tokens):
+        """
+        Remove a journal's tokens from the index.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+        :param tokens: The tokens the journal entry was indexed under.
+        :type tokens: iterable
+
+        :return: None
+        :rtype: None
+        """
+        self.total_length -= self.lengths.pop(journal_id, 0)
+        for token in set(tokens):
+            counts = self.counts.get(token)
+            if counts is not None:
+                counts.pop(journal_id, None)
+                if not counts:
+                    del self.counts[token]
+            ids = self.postings.get(token)
+            if ids is not None:
+                ids.discard(journal_id)
+                if not ids:
+                    del self.postings[token]
+                    if self.folded is not None:
+                        variants = self.folded.get(normalize(token), set())
+                        variants.discard(token)
+
+    def search(self, tokens):
+        """
+        Find the journals that contain every one of the given tokens.
+
+        The posting sets are intersected smallest first, so the cost is bounded by the
+        rarest token rather than by the size of the book.
+
+        :param tokens: The tokens to look up.
+        :type tokens: iterable
+
+        :return: The IDs of the matching journals.
+        :rtype: set
+        """
+        postings = sorted(
+            (self.postings.get(token, set()) for token in set(tokens)), key=len
+        )
+        if not postings:
+            return set()
+        result = set(postings[0])
+        for ids in postings[1:]:
+            if not result:
+                break
+            result &= ids
+        return result
+
+    def vocabulary(self):
+        """Return every indexed token"""
+        return self.postings.keys()
+
+    def contains(self, token):
+        """Return whether any journal contains a token"""
+        return token in self.postings
+
+    def variants(self, token, fold=False):
+        """
+        List the indexed tokens that a query token matches.
+
+        :param token: The query token.
+        :type token: str
+        :param fold: Optional. Match regardless of case and accents. Default is False.
+        :type fold: bool
+
+        :return: The matching indexed tokens.
+        :rtype: list
+        """
+        if not fold:
+            return [token] if token in self.postings else []
+        if self.folded is None:
+            self.folded = {}
+            for indexed in self.postings:
+                self.folded.setdefault(normalize(indexed), set()).add(indexed)
+        return list(self.folded.get(normalize(token), ()))
+
+    def frequencies(self, token, fold=False):
+        """
+        Count how many times a query token appears in each journal that contains it.
+
+        :param token: The query token.
+        :type token: str
+        :param fold: Optional. Match regardless of case and accents. Default is False.
+        :type fold: bool
+
+        :return: A mapping of journal ID to count.
+        :rtype: dict
+        """
+        frequencies = {}
+        for variant in self.variants(token, fold):
+            counts = self.counts.get(variant, {})
+            for journal_id in self.postings[variant]:
+                frequencies[journal_id] = frequencies.get(journal_id, 0) + counts.get(
+                    journal_id, 1
+                )
+        return frequencies
+
+    def scores(self, tokens, phrases=(), fold=False):
+        """
+        Score journals against a query with BM25.
+
+        A journal scores for every query token it contains, weighted by how rare the
+        token is across the book and discounted for long journals. Journals are only
+        scored if they contain every token of every phrase; whether the tokens are next
+        to each other is left to the caller to check.
+
+        :param tokens: The query tokens.
+        :type tokens: iterable
+        :param phrases: Optional. The tokens of each quoted phrase in the query.
+        :type phrases: list
+        :param fold: Optional. Match regardless of case and accents. Default is False.
+        :type fold: bool
+
+        :return: A mapping of journal ID to score, for every journal that matched.
+        :rtype: dict
+        """
+        documents = len(self.lengths)
+        if not documents:
+            return {}
+        average_length = self.total_length / documents or 1
+        required = None
+        for token in {token for phrase in phrases for token in phrase}:
+            ids = set(self.frequencies(token, fold))
+            required = ids if required is None else required & ids
+        scores = {}
+        for token in set(tokens):
+            frequencies = self.frequencies(token, fold)
+            idf = math.log(
+                1 + (documents - len(frequencies) + 0.5) / (len(frequencies) + 0.5)
+            )
+            for journal_id, frequency in frequencies.items():
+                if required is not None and journal_id not in required:
+                    continue
+                length = self.lengths.get(journal_id, 0) / average_length
+                scores[journal_id] = scores.get(journal_id, 0) + idf * (
+                    frequency
+                    * (BM25_K1 + 1)
+                    / (frequency + BM25_K1 * (1 - BM25_B + BM25_B * length))
+                )
+        return scores
+
+    def to_dict(self):
+        """
+        Convert the index into a JSON-serialisable dictionary.
+
+        Counts and lengths are written as a list of IDs and a list of numbers side by
+        side, rather than as [id, number] pairs, which halves the time json takes to
+        write and read them. The "version" key tells from_dict which layout it has.
+        """
+        return {
+            "version": 2,
+            "postings": {token: list(ids) for token, ids in self.postings.items()},
+            "counts": {
+                token: [list(counts), list(counts.values())]
+                for token, counts in self.counts.items()
+            },
+            "lengths": [list(self.lengths), list(self.lengths.values())],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """
+        Create an index from a dictionary produced by to_dict.
+
+        Indexes saved before the "version" key was added, with counts and lengths as
+        [id, number] pairs, are read too.
+
+        :param data: The postings, counts and lengths, as written by to_dict.
+        :type data: dict
+
+        :return: The restored index.
+        :rtype: InvertedIndex
+        """
+        postings = {token: set(ids) for token, ids in data["postings"].items()}
+        if data.get("version", 1) == 1:
+            return cls(
+                postings,
+                {token: dict(counts) for token, counts in data["counts"].items()},
+                dict(data["lengths"]),
+            )
+        return cls(
+            postings,
+            {token: dict(zip(*counts)) for token, counts in data["counts"].items()},
+            dict(zip(*data["lengths"])),
+        )
+
+
+class DateIndex:
+    """Keep journal IDs sorted by creation date for range queries"""
+
+    def __init__(self, entries=()):
+        """
+        Initialise the index.
+
+        :param entries: Optional. (creation_date, journal_id) pairs to index.
+        :type entries: iterable, optional
+        """
+        self.keys = sorted(
+            (creation_date.toordinal(), journal_id)
+            for creation_date, journal_id in entries
+        )
+
+    def add(self, journal_id, creation_date):
+        """
+        Add a journal to the index.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+        :param creation_date: The creation date of the journal entry.
+        :type creation_date: datetime.date
+
+        :return: None
+        :rtype: None
+        """
+        bisect.insort(self.keys, (creation_date.toordinal(), journal_id))
+
+    def add_many(self, entries):
+        """
+        Add many journals to the index at once.
+
+        The keys are appended and the list re-sorted once, which is much cheaper than
+        inserting them one at a time.
+
+        :param entries: (creation_date, journal_id) pairs to index.
+        :type entries: iterable
+
+        :return: None
+        :rtype: None
+        """
+        self.keys.extend(
+            (creation_date.toordinal(), journal_id)
+            for creation_date, journal_id in entries
+        )
+        self.keys.sort()
+
+    def remove(self, journal_id, creation_date):
+        """
+        Remove a journal from the index.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+        :param creation_date: The creation date the journal entry was indexed under.
+        :type creation_date: datetime.date
+
+        :return: None
+        :rtype: None
+        """
+        key = (creation_date.toordinal(), journal_id)
+        position = bisect.bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            del self.keys[position]
+
+    def range(self, start_date, end_date):
+        """
+        Yield the IDs of journals created between two dates, inclusive.
+
+        The ends of the range are found with a binary search, so a query costs
+        O(log N + k) for k results. IDs are yielded in date order, then ID order.
+
+        :param start_date: Start date of the date range.
+        :type start_date: datetime.date
+        :param end_date: End date of the date range.
+        :type end_date: datetime.date
+
+        :return: A generator of journal IDs.
+        :rtype: generator
+        """
+        start = bisect.bisect_left(self.keys, (start_date.toordinal(),))
+        end = bisect.bisect_left(self.keys, (end_date.toordinal() + 1,))
+        for position in range(start, end):
+            yield self.keys[position][1]
+
+
+def parse_tag_query(query):
+    """
+    Parse a tag query into groups of required and excluded tags.
+
+    A query is made of tags joined by AND, OR and NOT, for example
+    "work AND urgent NOT done". NOT binds tightest, then AND, then OR, and tags
+    written next to each other without an operator are ANDed. A query with no
+    operators is read as a comma-separated list of tags, any of which may match,
+    which is how the Menu has always taken tag searches.
+
+    :param query: The query text.
+    :type query: str
+
+    :return: A list of (required, excluded) pairs of tag lists, one for each OR branch.
+    :rtype: list
+    """
+    words = query.replace(",", " , ").split()
+    if not any(word in ("AND", "OR", "NOT") for word in words):
+        tags = [tag.strip() for tag in query.split(",")]
+        return [([tag], []) for tag in tags if tag]
+
+    groups = [([], [])]
+    negate = False
+    for word in words:
+        if word in ("OR", ","):
+            if groups[-1] != ([], []):
+                groups.append(([], []))
+        elif word == "NOT":
+            negate = True
+        elif word != "AND":
+            groups[-1][1 if negate else 0].append(word)
+            negate = False
+    return [group for group in groups if group != ([], [])]
+
+
+class TagIndex:
+    """Map each tag to the set of journal IDs carrying it"""
+
+    def __init__(self, entries=()):
+        """
+        Initialise the index.
+
+        :param entries: Optional. (journal_id, tags) pairs to index.
+        :type entries: iterable, optional
+        """
+        self.postings = {}
+        for journal_id, tags in entries:
+            self.add(journal_id, tags)
+
+    def add(self, journal_id, tags):
+        """
+        Add a journal's tags to the index.
+
+        Surrounding whitespace is stripped from each tag and empty tags are skipped.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+        :param tags: The tags of the journal entry.
+        :type tags: iterable
+
+        :return: None
+        :rtype: None
+        """
+        for tag in tags:
+            tag = tag.strip()
+            if tag:
+                self.postings.setdefault(tag, set()).add(journal_id)
+
+    def add_many(self, entries):
+        """
+        Add many journals' tags to the index at once.
+
+        :param entries: (journal_id, tags) pairs to index.
+        :type entries: iterable
+
+        :return: None
+        :rtype: None
+        """
+        grouped = {}
+        for journal_id, tags in entries:
+            for tag in tags:
+                tag = tag.strip()
+                if tag:
+                    grouped.setdefault(tag, []).append(journal_id)
+        for tag, ids in grouped.items():
+            self.postings.setdefault(tag, set()).update(ids)
+
+    def remove(self, journal_id, tags):
+        """
+        Remove a journal's tags from the index.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+        :param tags: The tags the journal entry was indexed under.
+        :type tags: iterable
+
+        :return: None
+        :rtype: None
+        """
+        for tag in tags:
+            tag = tag.strip()
+            ids = self.postings.get(tag)
+            if ids is not None:
+                ids.discard(journal_id)
+                if not ids:
+                    del self.postings[tag]
+
+    def ids(self, tag):
+        """
+        Look up the journals carrying a tag.
+
+        :param tag: The tag to look up.
+        :type tag: str
+
+        :return: The IDs of the journals with that tag. Do not modify it.
+        :rtype: set
+        """
+        return self.postings.get(tag.strip(), set())
+
+    def query(self, groups, all_ids):
+        """
+        Evaluate a parsed tag query with set algebra.
+
+        Each group's required tags are intersected starting from the smallest
+        posting set, its excluded tags are subtracted, and the groups are unioned.
+        A group with no required tags starts from every journal.
+
+        :param groups: The (required, excluded) pairs returned by parse_tag_query.
+        :type groups: list
+        :param all_ids: The IDs of every journal, used by groups with only exclusions.
+        :type all_ids: iterable
+
+        :return: The IDs of the matching journals.
+        :rtype: set
+        """
+        result = set()
+        for required, excluded in groups:
+            if required:
+                postings = sorted((self.ids(tag) for tag in required), key=len)
+                matches = set(postings[0])
+                for ids in postings[1:]:
+                    if not matches:
+                        break
+                    matches &= ids
+            else:
+                matches = set(all_ids)
+            for tag in excluded:
+                if not matches:
+                    break
+                matches -= self.ids(tag)
+            result |= matches
+        return result
+
+
+def edit_distance(first, second, limit=None):
+    """
+    Count the single-character insertions, deletions and substitutions needed to turn
+    one string into another (the Levenshtein distance).
+
+    :param first: The first string.
+    :type first: str
+    :param second: The second string.
+    :type second: str
+    :param limit: Optional. Stop early once the distance is known to be over this.
+    :type limit: int, optional
+
+    :return: The edit distance, or limit + 1 if it is over the limit.
+    :rtype: int
+    """
+    if len(first) < len(second):
+        first, second = second, first
+    if limit is not None and len(first) - len(second) > limit:
+        return limit + 1
+    previous = list(range(len(second) + 1))
+    for row, first_char in enumerate(first, 1):
+        current = [row]
+        for column, second_char in enumerate(second, 1):
+            current.append(
+                min(
+                    previous[column] + 1,
+                    current[column - 1] + 1,
+                    previous[column - 1] + (first_char != second_char),
+                )
+            )
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def trigrams(word):
+    """
+    Split a word into overlapping three-character pieces.
+
+    The word is padded so its first and last letters get pieces of their own.
+
+    :param word: The word to split.
+    :type word: str
+
+    :return: The distinct trigrams.
+    :rtype: set
+    """
+    padded = f"  {word} "
+    return {padded[start : start + 3] for start in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """
+    Find the words within an edit distance of a query word without checking them all.
+
+    One edit changes at most three of a word's trigrams, so a word within d edits of
+    the query shares at least (number of query trigrams - 3d) trigrams with it. Only
+    the words that share enough trigrams have their edit distance worked out. For short
+    words and larger distances that bound is no help, and every word of a similar
+    length is checked instead, with a distance calculation that gives up early.
+
+    Words are filed under a key, such as their normalised form, and several words can
+    share a key.
+    """
+
+    def __init__(self, words=(), key=None):
+        """
+        Initialise the index.
+
+        :param words: Optional. The words to add.
+        :type words: iterable, optional
+        :param key: Optional. A function giving the form of a word to compare, such as
+            indexes.normalize. Defaults to the word itself.
+        :type key: callable, optional
+        """
+        self.key = key
+        self.grams = {}
+        self.words = {}
+        for word in words:
+            self.add(word)
+
+    def add(self, word):
+        """
+        Add a word to the index.
+
+        :param word: The word to add.
+        :type word: str
+
+        :return: None
+        :rtype: None
+        """
+        key = self.key(word) if self.key else word
+        words = self.words.get(key)
+        if words is None:
+            self.words[key] = {word}
+            for gram in trigrams(key):
+                self.grams.setdefault(gram, set()).add(key)
+        else:
+            words.add(word)
+
+    def remove(self, word):
+        """
+        Remove a word from the index.
+
+        :param word: The word to remove. Nothing happens if it isn't in the index.
+        :type word: str
+
+        :return: None
+        :rtype: None
+        """
+        key = self.key(word) if self.key else word
+        words = self.words.get(key)
+        if words is None:
+            return
+        words.discard(word)
+        if not words:
+            del self.words[key]
+            for gram in trigrams(key):
+                keys = self.grams.get(gram)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.grams[gram]
+
+    def search(self, word, max_distance):
+        """
+        Find the words within an edit distance of a word.
+
+        :param word: The word to look for.
+        :type word: str
+        :param max_distance: The largest edit distance to accept.
+        :type max_distance: int
+
+        :return: (distance, word) pairs, closest first.
+        :rtype: list
+        """
+        key = self.key(word) if self.key else word
+        grams = trigrams(key)
+        needed = len(grams) - 3 * max_distance
+        if needed > 0:
+            shared = {}
+            for gram in grams:
+                for candidate in self.grams.get(gram, ()):
+                    shared[candidate] = shared.get(candidate, 0) + 1
+            candidates = [
+                candidate for candidate, count in shared.items() if count >= needed
+            ]
+        else:
+            candidates = self.words
+        results = []
+        for candidate in candidates:
+            if abs(len(candidate) - len(key)) > max_distance:
+                continue
+            distance = edit_distance(key, candidate, max_distance)
+            if distance <= max_distance:
+                results.extend((distance, found) for found in self.words[candidate])
+        results.sort()
+        return results
@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from benchmark import TAGS, WORDS
+
+
+async def send(reader, writer, method, path, body=None):
+    """
+    Send an HTTP/1.1 request on a kept-alive connection and read the response.
+
+    :param reader: The connection's reader.
+    :type reader: asyncio.StreamReader
+    :param writer: The connection's writer.
+    :type writer: asyncio.StreamWriter
+    :param method: The HTTP method.
+    :type method: str
+    :param path: The request target.
+    :type path: str
+    :param body: Optional. A value to send as JSON.
+    :type body: object
+
+    :return: The response status and decoded JSON body.
+    :rtype: tuple
+    """
+    data = b"" if body is None else json.dumps(body).encode("utf-8")
+    writer.write(
+        f"{method} {path} HTTP/1.1\r\nHost: scribe\r\n"
+        f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode(
+            "latin-1"
+        )
+        + data
+    )
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    return status, json.loads(await reader.readexactly(length))
+
+
+def random_request(rng, write_ratio, known_ids):
+    """
+    Choose a request for a simulated client.
+
+    :param rng: The client's random number generator.
+    :type rng: random.Random
+    :param write_ratio: The share of requests that change the book.
+    :type write_ratio: float
+    :param known_ids: IDs of entries the clients have added, to read and edit.
+    :type known_ids: list
+
+    :return: The operation's name, HTTP method, path and body.
+    :rtype: tuple
+    """
+    if rng.random() < write_ratio:
+        memo = " ".join(rng.choices(WORDS, k=rng.randint(5, 30)))
+        tags = rng.sample(TAGS, rng.randint(0, 3))
+        if known_ids and rng.random() < 0.3:
+            return "update", "PUT", f"/entries/{rng.choice(known_ids)}", {
+                "memo": memo,
+                "tags": tags,
+            }
+        return "add", "POST", "/entries", {"memo": memo, "tags": tags}
+    choice = rng.random()
+    if choice < 0.4:
+        return "search", "GET", f"/search?q={rng.choice(WORDS)}", None
+    if choice < 0.6:
+        return "tags", "GET", f"/search?tags={rng.choice(TAGS)}&limit=20", None
+    if choice < 0.8 and known_ids:
+        return "get", "GET", f"/entries/{rng.choice(known_ids)}", None
+    return "list", "GET", f"/entries?offset={rng.randint(0, 100)}&limit=10", None
+
+
+async def client(host, port, deadline, write_ratio, seed, latencies, known_ids):
+    """Send requests from one connection until the deadline, recording latencies"""
+    rng = random.Random(seed)
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            name, method, path, body = random_request(rng, write_ratio, known_ids)
+            start = time.perf_counter()
+            status, result = await send(reader, writer, method, path, body)
+            latencies.setdefault(name, []).append(time.perf_counter() - start)
+            if status >= 400 and status != 404:
+                latencies.setdefault("errors", []).append(0.0)
+            elif name == "add":
+                known_ids.append(result["id"])
+    finally:
+        writer.close()
+
+
+def percentile(values, fraction):
+    """Return the value below which a fraction of the sorted values fall"""
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def load_test(
+    host="127.0.0.1", port=8765, clients=32, duration=10.0, write_ratio=0.1
+):
+    """
+    Run concurrent clients against a Scribe HTTP server.
+
+    :param host: Optional. The server's address. Default is 127.0.0.1.
+    :type host: str
+    :param port: Optional. The server's port. Default is 8765.
+    :type port: int
+    :param clients: Optional. How many connections to run at once. Default is 32.
+    :type clients: int
+    :param duration: Optional. How long to run for, in seconds. Default is 10.
+    :type duration: float
+    :param write_ratio: Optional. The share of requests that add or edit entries.
+        Default is 0.1.
+    :type write_ratio: float
+
+    :return: For each operation, and for "all", the number of requests and the
+        p50, p90, p99 and maximum latency in milliseconds, plus the overall "throughput"
+        in requests per second and the number of "errors".
+    :rtype: dict
+    """
+    latencies = {}
+    known_ids = []
+    start = time.perf_counter()
+    deadline = start + duration
+    await asyncio.gather(
+        *(
+            client(host, port, deadline, write_ratio, seed, latencies, known_ids)
+            for seed in range(clients)
+        )
+    )
+    elapsed = time.perf_counter() - start
+    errors = len(latencies.pop("errors", []))
+    latencies["all"] = [value for values in latencies.values() for value in values]
+    report = {}
+    for name, values in latencies.items():
+        values.sort()
+        if not values:
+            continue
+        report[name] = {
+            "requests": len(values),
+            "p50_ms": percentile(values, 0.5) * 1000,
+            "p90_ms": percentile(values, 0.9) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+        }
+    report["throughput"] = len(latencies["all"]) / elapsed
+    report["errors"] = errors
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load test a Scribe HTTP server started with 'main.py http'"
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument(
+        "--write-ratio", type=float, default=0.1, help="share of requests that write"
+    )
+    parser.add_argument("--json", action="store_true", help="print the report as JSON")
+    args = parser.parse_args()
+
+    report = asyncio.run(
+        load_test(args.host, args.port, args.clients, args.seconds, args.write_ratio)
+    )
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return
+    print(
+        f"{'operation':<10}{'requests':>10}{'p50 ms':>10}"
+        f"{'p90 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    )
+    for name, result in report.items():
+        if isinstance(result, dict):
+            print(
+                f"{name:<10}{result['requests']:>10}{result['p50_ms']:>10.2f}"
+                f"{result['p90_ms']:>10.2f}{result['p99_ms']:>10.2f}{result['max_ms']:>10.2f}"
+            )
+    print(f"{report['throughput']:,.0f} requests/s, {report['errors']} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,17 @@
 import sys
 import os
+import argparse
+import atexit
+import cProfile
 import datetime
+import json
+import pstats
 import threading
 import time
 import schedule
 
-from scribe import JournalBook
+from scribe import JournalBook, migrate_storage, read_import_file, restore_backup
+from backup import BackupManager
 
 
 class Menu:
@@ -15,17 +21,30 @@ class Menu:
     Initialise the JournalBook object and define the choices dictionary.
 
     Args:
-    None
+    storage_file (str, optional): The journal file to open. Defaults to "journal_entries.json".
+    journalbook (JournalBook, optional): An already open journalbook to use instead, so
+        it can be shared with other threads such as the backup scheduler.
 
     Returns:
     None
     """
 
-    def __init__(self):
+    def __init__(self, storage_file="journal_entries.json", journalbook=None):
         self.should_exit = False
         self.password_file = "password.txt"
         self.password = self.load_password()
-        self.journalbook = JournalBook()
+        if journalbook is None:
+            # Load and save in the background so neither startup nor edits wait on the disk
+            journalbook = JournalBook(
+                storage_file, background_load=True, background_writes=True
+            )
+        self.journalbook = journalbook
+        # How many entries show_journals prints at a time
+        self.page_size = 10
+        # How many of the best matches a keyword search shows
+        self.search_limit = 100
+        # How many typos a fuzzy search allows in each word unless told otherwise
+        self.fuzzy_distance = 2
         self.choices = {
             "1": self.add_journal,
             "2": self.show_journals,
@@ -129,9 +148,11 @@ class Menu:
 
     def show_journals(self, journals=None):
         """
-        Display all journal entries in journalbook.
+        Display all journal entries in journalbook, a page at a time.
 
         If no journals are provided, it will use the journals from the journalbook object.
+        Only the entries on the current page are read and printed. After each page the
+        user can move to the next or previous page, jump to a page, or stop.
 
         Args:
         journals (list, optional): A list of Journal objects. Defaults to None.
@@ -140,20 +161,74 @@ class Menu:
         None: This function does not return any value. It prints the journal entries.
         """
         if not journals:
-            journals = self.journalbook.journals
-        for journal in journals:
-            tags_str = ", ".join(journal.tags) if journal.tags else None
-            if tags_str:
-                print(
-                    f"{journal.id}. {journal.memo}\n"
-                    f"Tags: {tags_str}\n"
-                    f"Date created: {journal.creation_date}"
+            total = self.journalbook.count_journals()
+
+            def get_page(offset):
+                return self.journalbook.iter_journals(offset, self.page_size)
+
+        else:
+            total = len(journals)
+
+            def get_page(offset):
+                return journals[offset : offset + self.page_size]
+
+        pages = max(1, -(-total // self.page_size))
+        page = 0
+        while True:
+            for journal in get_page(page * self.page_size):
+                self.show_journal(journal)
+            if pages == 1:
+                return
+            choice = (
+                input(
+                    f"Page {page + 1} of {pages}. "
+                    "[n]ext (Enter), [p]revious, [j]ump to page, [q]uit: "
                 )
+                .strip()
+                .lower()
+            )
+            if choice in ("", "n"):
+                if page + 1 == pages:
+                    return
+                page += 1
+            elif choice == "p":
+                page = max(page - 1, 0)
+            elif choice == "j":
+                try:
+                    target = int(input(f"Page number (1-{pages}): "))
+                except ValueError:
+                    target = 0
+                if 1 <= target <= pages:
+                    page = target - 1
+                else:
+                    print("Invalid page number.")
+            elif choice == "q":
+                return
             else:
-                print(
-                    f"{journal.id}. {journal.memo}\n"
-                    f"Date created: {journal.creation_date}"
-                )
+                print("Invalid choice. Please enter a valid option.")
+
+    def show_journal(self, journal):
+        """
+        Display a single journal entry.
+
+        Args:
+        journal (Journal): The journal entry to display.
+
+        Returns:
+        None: This function does not return any value. It prints the journal entry.
+        """
+        tags_str = ", ".join(journal.tags) if journal.tags else None
+        if tags_str:
+            print(
+                f"{journal.id}. {journal.memo}\n"
+                f"Tags: {tags_str}\n"
+                f"Date created: {journal.creation_date}"
+            )
+        else:
+            print(
+                f"{journal.id}. {journal.memo}\n"
+                f"Date created: {journal.creation_date}"
+            )
 
     def add_journal(self):
         """
@@ -175,7 +250,7 @@ class Menu:
         Display sub-options for searching journal entries.
 
         This method displays sub-options for searching journal entries, including search by keyword,
-        search by tags, and search by date.
+        search by tags, search by date, and fuzzy search, which tolerates typos.
 
         Args:
         None
@@ -190,7 +265,8 @@ class Menu:
                   1. Search by keyword
                   2. Search by tags
                   3. Search by date
-                  4. Back to main menu
+                  4. Fuzzy search (allows for typos)
+                  5. Back to main menu
                   """
             )
             choice = input("Enter an option: ")
@@ -202,6 +278,8 @@ class Menu:
             elif choice == "3":
                 self.search_by_date()
             elif choice == "4":
+                self.fuzzy_search()
+            elif choice == "5":
                 break
             else:
                 print("Invalid choice. Please enter a valid option.")
@@ -211,7 +289,9 @@ class Menu:
         Search journal entries by keyword.
 
         This method prompts the user to enter a keyword and searches for journal entries
-        containing that keyword.
+        containing that keyword. Whole words are looked up in the keyword index first and
+        the best matches are shown first, ignoring case; if nothing matches, the search
+        falls back to a substring scan so partial words are still found.
 
         Args:
         None
@@ -219,8 +299,16 @@ class Menu:
         Returns:
         None: This function does not return any value. It prints the matching journal entries.
         """
-        keyword = input("Enter keyword to search: ")
-        journals = self.journalbook.search_journal(keyword)
+        keyword = input('Enter keywords to search (use "quotes" for a phrase): ')
+        journals = self.journalbook.search_journal(
+            keyword, mode="ranked", limit=self.search_limit, fold=True
+        )
+        if not journals:
+            journals = self.journalbook.search_journal(
+                keyword, mode="substring", fold=True
+            )
+        elif len(journals) == self.search_limit:
+            print(f"Showing the {self.search_limit} best matches.")
         self.show_journals(journals)
 
     def search_by_tags(self):
@@ -228,7 +316,28 @@ class Menu:
         Search journal entries by tags.
 
         This method prompts the user to enter tags and searches for journal entries
-        containing any of those tags.
+        containing any of those tags. Tags can also be combined with AND, OR and NOT,
+        for example "work AND urgent NOT done".
+
+        Args:
+        None
+
+        Returns:
+        None: This function does not return any value. It prints the matching journal entries.
+        """
+        query = input(
+            "Enter tags (comma-separated), or a query such as 'work AND urgent NOT done': "
+        )
+        journals = self.journalbook.query_tags(query)
+        self.show_journals(journals)
+
+    def fuzzy_search(self):
+        """
+        Search journal entries by keyword or tag, allowing for typos.
+
+        This method prompts the user for keywords or tags and how many typos to allow in
+        each word, which defaults to self.fuzzy_distance. Entries using words or tags
+        within that many edits of the ones entered are shown, ignoring case.
 
         Args:
         None
@@ -236,8 +345,28 @@ class Menu:
         Returns:
         None: This function does not return any value. It prints the matching journal entries.
         """
-        tags = input("Enter tags (comma-separated): ").strip().split(",")
-        journals = self.journalbook.search_by_tags(tags)
+        target = input("Search keywords or tags? (k/t): ").strip().lower()
+        if target not in ("k", "t"):
+            print("Invalid choice. Please enter 'k' or 't'.")
+            return
+        text = input(
+            "Enter keywords to search: "
+            if target == "k"
+            else "Enter tags (comma-separated): "
+        )
+        distance = input(f"Typos to allow per word [{self.fuzzy_distance}]: ").strip()
+        try:
+            distance = int(distance) if distance else self.fuzzy_distance
+        except ValueError:
+            print("Invalid number. Please enter a whole number.")
+            return
+        if target == "k":
+            journals = self.journalbook.fuzzy_search(text, distance, self.search_limit)
+        else:
+            journals = self.journalbook.fuzzy_search_by_tags(text.split(","), distance)
+        if not journals:
+            print("No matching journal entries found.")
+            return
         self.show_journals(journals)
 
     def search_by_date(self):
@@ -245,7 +374,8 @@ class Menu:
         Search journal entries by date range.
 
         This method prompts the user to enter a start date and end date, and searches for journal entries
-        within that date range.
+        within that date range. Matches are printed as they are found rather than after the whole
+        range has been collected.
 
         Args:
         None
@@ -258,10 +388,15 @@ class Menu:
         try:
             start_date = datetime.datetime.strptime(start_date, "%Y-%m-%d").date()
             end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d").date()
-            journals = self.journalbook.search_by_date(start_date, end_date)
-            self.show_journals(journals)
         except ValueError:
             print("Invalid date format. Please use YYYY-MM-DD.")
+            return
+        found = False
+        for journal in self.journalbook.iter_by_date(start_date, end_date):
+            self.show_journal(journal)
+            found = True
+        if not found:
+            print("No matching journal entries found.")
 
     def edit_journal(self):
         """
@@ -352,38 +487,65 @@ class Menu:
         1. Export to JSON
         2. Export to CSV
         3. Export to Text
+        4. Export to JSON Lines
         """
         )
 
         choice = input("Enter an option: ")
-        if choice == "1":
-            self.export_entries("exported_journal.json", "json")
-        elif choice == "2":
-            self.export_entries("exported_journal.csv", "csv")
-        elif choice == "3":
-            self.export_entries("exported_journal.txt", "txt")
-        else:
+        formats = {"1": "json", "2": "csv", "3": "txt", "4": "jsonl"}
+        if choice not in formats:
             print("Invalid option. Please select a valid export option.")
-
-    def export_entries(self, filename, file_format="json"):
+            return
+        file_format = formats[choice]
+
+        filters = {}
+        if input("Only export some entries? (y/n): ").lower() == "y":
+            start_date = input("Start date (YYYY-MM-DD, blank for none): ").strip()
+            end_date = input("End date (YYYY-MM-DD, blank for none): ").strip()
+            try:
+                if start_date:
+                    filters["start_date"] = datetime.datetime.strptime(
+                        start_date, "%Y-%m-%d"
+                    ).date()
+                if end_date:
+                    filters["end_date"] = datetime.datetime.strptime(
+                        end_date, "%Y-%m-%d"
+                    ).date()
+            except ValueError:
+                print("Invalid date format. Please use YYYY-MM-DD.")
+                return
+            tag_query = input("Tag query (blank for any tags): ").strip()
+            if tag_query:
+                filters["tag_query"] = tag_query
+
+        filename = f"exported_journal.{file_format}"
+        compress = input("Compress with gzip? (y/n): ").lower() == "y"
+        if compress:
+            filename += ".gz"
+        self.export_entries(filename, file_format, compress=compress, **filters)
+
+    def export_entries(self, filename, file_format="json", **options):
         """
         Export journal entries to a file in the specified format.
 
         :param filename: The name of the file to export the entries to.
         :type filename: str
-        :param file_format: The format of the file to export to ('json', 'csv', 'txt'). Default is 'json'.
+        :param file_format: The format of the file to export to ('json', 'jsonl', 'csv', 'txt'). Default is 'json'.
         :type file_format: str
+        :param options: Optional. Compression and filter options, passed on to JournalBook.export_entries.
+        :type options: dict
 
         :return: None
         :rtype: None
         """
-        self.journalbook.export_entries(filename, file_format)
+        self.journalbook.export_entries(filename, file_format, **options)
 
     def quit(self):
         """
         Terminate the program.
 
-        This method prints a thank you message and exits the program.
+        This method writes any changes that are still waiting to be saved, prints a thank
+        you message and exits the program.
 
         Args:
         None
@@ -391,6 +553,7 @@ class Menu:
         Returns:
         None: This function does not return any value. It terminates the program.
         """
+        self.journalbook.close()
         print("Thank you for using Scribe today")
         # Set the flag to exit
         self.should_exit = True
@@ -401,14 +564,363 @@ def schedule_jobs(menu):
         schedule.run_pending()
         time.sleep(1)
 
+def parse_args(argv=None):
+    """
+    Parse Scribe's command-line arguments.
+
+    Args:
+    argv (list, optional): The arguments to parse. Defaults to sys.argv.
+
+    Returns:
+    argparse.Namespace: The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        description="Scribe - Your Command Line Journal"
+    )
+    parser.add_argument(
+        "--storage",
+        default="journal_entries.json",
+        help="journal file to open; files ending in .db are stored in SQLite",
+    )
+    parser.add_argument(
+        "--socket",
+        help="send add, search, export and backup to the server on this Unix socket "
+        "instead of opening the journal; with serve, the socket to listen on",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="FILE",
+        help="run under cProfile, save the pstats data to FILE and print the "
+        "slowest functions when Scribe exits",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="record call counts, latencies and bytes read and written, and write "
+        "them to FILE in the Prometheus text format when Scribe exits",
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    migrate_parser = subparsers.add_parser(
+        "migrate", help="copy a journal into another file, e.g. from JSON to SQLite"
+    )
+    migrate_parser.add_argument("source", help="journal file to copy from")
+    migrate_parser.add_argument("target", help="journal file to copy into")
+    import_parser = subparsers.add_parser(
+        "import", help="add every entry in a JSON, JSONL or CSV file to the journal"
+    )
+    import_parser.add_argument("file", help="file of entries to import")
+    import_parser.add_argument(
+        "--format",
+        choices=["json", "jsonl", "csv"],
+        help="format of the file; defaults to its extension",
+    )
+    restore_parser = subparsers.add_parser(
+        "restore", help="replace the journal with one of its backups"
+    )
+    restore_parser.add_argument(
+        "--backups", default="backups", help="directory the backups are kept in"
+    )
+    restore_group = restore_parser.add_mutually_exclusive_group()
+    restore_group.add_argument("--name", help="name of the backup to restore")
+    restore_group.add_argument(
+        "--at",
+        type=datetime.datetime.fromisoformat,
+        help="restore the journal as it was at this time, e.g. 2024-05-01T12:00",
+    )
+    restore_group.add_argument(
+        "--list", action="store_true", help="list the backups instead of restoring one"
+    )
+    add_parser = subparsers.add_parser("add", help="add a journal entry")
+    add_parser.add_argument("memo", help="the entry's text")
+    add_parser.add_argument("--tags", default="", help="comma-separated tags")
+    search_parser = subparsers.add_parser("search", help="search journal entries")
+    search_parser.add_argument(
+        "query", nargs="?", help="words to search for; leave out to filter only"
+    )
+    search_parser.add_argument(
+        "--mode",
+        choices=["ranked", "index", "substring", "regex", "fuzzy"],
+        default="ranked",
+    )
+    search_parser.add_argument("--limit", type=int, default=10)
+    search_parser.add_argument(
+        "--case-sensitive", action="store_true", help="don't ignore case and accents"
+    )
+    add_filter_arguments(search_parser)
+    search_parser.add_argument(
+        "--json", action="store_true", help="print the entries as JSON Lines"
+    )
+    export_parser = subparsers.add_parser("export", help="export journal entries to a file")
+    export_parser.add_argument("file", help="name of the file to write")
+    export_parser.add_argument(
+        "--format", choices=["json", "jsonl", "csv", "txt"], default="json"
+    )
+    export_parser.add_argument(
+        "--directory", default=".", help="directory to write the file in"
+    )
+    export_parser.add_argument("--compress", action="store_true", help="gzip the file")
+    add_filter_arguments(export_parser)
+    backup_parser = subparsers.add_parser("backup", help="back up the journal")
+    backup_parser.add_argument(
+        "--backups", default="backups", help="directory the backups are kept in"
+    )
+    backup_parser.add_argument(
+        "--full", action="store_true", help="take a full checkpoint"
+    )
+    subparsers.add_parser(
+        "serve",
+        help="keep the journal open and answer JSON-RPC requests on standard input, "
+        "or on --socket",
+    )
+    http_parser = subparsers.add_parser(
+        "http", help="keep the journal open and serve it over a local HTTP API"
+    )
+    http_parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="address to listen on; the default only accepts local connections",
+    )
+    http_parser.add_argument("--port", type=int, default=8765)
+    return parser.parse_args(argv)
+
+
+def add_filter_arguments(parser):
+    """Add the date range and tag query options shared by search and export"""
+    parser.add_argument(
+        "--from",
+        dest="start_date",
+        type=datetime.date.fromisoformat,
+        help="only entries created on or after this date (YYYY-MM-DD)",
+    )
+    parser.add_argument(
+        "--to",
+        dest="end_date",
+        type=datetime.date.fromisoformat,
+        help="only entries created on or before this date (YYYY-MM-DD)",
+    )
+    parser.add_argument("--tags", help="only entries matching this tag query")
+
+
+def print_entry(entry):
+    """
+    Display a journal entry dictionary, in the same layout as Menu.show_journal.
+
+    Args:
+    entry (dict): The journal entry dictionary.
+
+    Returns:
+    None
+    """
+    print(f"{entry['id']}. {entry['memo']}")
+    if entry["tags"]:
+        print(f"Tags: {', '.join(entry['tags'])}")
+    print(f"Date created: {entry['creation_date']}")
+
+
+def run_command(args):
+    """
+    Run one of the add, search, export and backup commands without the menu.
+
+    With --socket the command is sent to a running server, which already has the
+    journal loaded. Otherwise the journal is opened for this command alone.
+
+    Args:
+    args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+    int: The exit status, 0 on success.
+    """
+    # Imported here, so the menu doesn't load the server modules it never uses
+    from server import Client, JournalService, RpcError
+
+    if args.command == "add":
+        params = {"memo": args.memo, "tags": args.tags}
+    elif args.command == "backup":
+        params = {"directory": os.path.abspath(args.backups), "full": args.full}
+    else:
+        params = {
+            "start_date": args.start_date and args.start_date.isoformat(),
+            "end_date": args.end_date and args.end_date.isoformat(),
+            "tags": args.tags,
+        }
+        if args.command == "search":
+            params.update(
+                query=args.query,
+                mode=args.mode,
+                limit=args.limit,
+                fold=not args.case_sensitive,
+            )
+        else:
+            params.update(
+                filename=args.file,
+                file_format=args.format,
+                directory=os.path.abspath(args.directory),
+                compress=args.compress,
+            )
+
+    journalbook = None
+    try:
+        if args.socket:
+            client = Client(args.socket)
+            call, finish = client.call, client.close
+        else:
+            journalbook = open_journalbook(args)
+            service = JournalService(journalbook)
+
+            def call(method, params):
+                return getattr(service, method)(**params)
+
+            finish = journalbook.close
+        try:
+            result = call(args.command, params)
+        finally:
+            finish()
+    except (OSError, RpcError, ValueError) as error:
+        print(f"Error: {error}")
+        return 1
+
+    if args.command == "add":
+        print(f"Added entry {result['id']}")
+    elif args.command == "search":
+        for entry in result:
+            if args.json:
+                print(json.dumps(entry))
+            else:
+                print_entry(entry)
+                print()
+        if not args.json:
+            print(f"{len(result)} entries found")
+    elif args.command == "export":
+        if args.socket:
+            print(f"File exported successfully to: {result}")
+    elif args.socket:
+        if result is None:
+            print("No changes since the last backup.")
+        else:
+            print(
+                f"Backup created: {os.path.join(args.backups, result['file'])} "
+                f"({result['kind']}, {result['changes']} changes)"
+            )
+    return 0
+
+def open_journalbook(args, **options):
+    """
+    Open the journal named on the command line.
+
+    With --metrics the journalbook is instrumented, and its metrics are written to
+    the file when Scribe exits.
+
+    Args:
+    args (argparse.Namespace): The parsed command-line arguments.
+    **options: Other arguments for JournalBook.
+
+    Returns:
+    JournalBook: The open journalbook.
+    """
+    journalbook = JournalBook(args.storage, instrument=bool(args.metrics), **options)
+    if args.metrics:
+
+        def write_metrics():
+            with open(args.metrics, "w") as file:
+                file.write(journalbook.metrics_text())
+
+        atexit.register(write_metrics)
+    return journalbook
+
+
 def main():
-    journalbook = JournalBook()
+    args = parse_args()
+    if not args.profile:
+        run(args)
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.runcall(run, args)
+    finally:
+        profiler.dump_stats(args.profile)
+        stats = pstats.Stats(profiler, stream=sys.stderr)
+        stats.sort_stats("cumulative").print_stats(25)
+
+
+def run(args):
+    """
+    Run the command given on the command line, or the menu if there is none.
+
+    Args:
+    args (argparse.Namespace): The parsed command-line arguments.
+
+    Returns:
+    None
+    """
+    if args.command == "migrate":
+        count = migrate_storage(args.source, args.target)
+        print(f"Copied {count} journal entries from {args.source} to {args.target}")
+        return
+    if args.command == "restore":
+        if args.list:
+            for record in BackupManager(args.backups).load_manifest():
+                print(
+                    f"{record['name']}  {record['created']}  "
+                    f"{record['kind']:<11}  {record['changes']} changes"
+                )
+            return
+        try:
+            count = restore_backup(args.storage, args.backups, args.name, args.at)
+        except (OSError, ValueError) as error:
+            print(f"Error restoring backup: {error}")
+            return
+        print(f"Restored {count} journal entries into {args.storage}")
+        return
+    if args.command in ("add", "search", "export", "backup"):
+        sys.exit(run_command(args))
+    if args.command == "serve":
+        from server import JournalService, serve_stdio, serve_unix
+
+        journalbook = open_journalbook(args, background_writes=True)
+        service = JournalService(journalbook)
+        try:
+            if args.socket:
+                print(f"Serving {args.storage} on {args.socket}", file=sys.stderr)
+                serve_unix(service, args.socket)
+            else:
+                serve_stdio(service)
+        finally:
+            journalbook.close()
+        return
+    if args.command == "http":
+        import http_api
+
+        journalbook = open_journalbook(args)
+        try:
+            http_api.run(journalbook, args.host, args.port)
+        finally:
+            journalbook.close()
+        return
+    if args.command == "import":
+        journalbook = open_journalbook(args)
+        try:
+            count, errors = journalbook.bulk_import(
+                read_import_file(args.file, args.format)
+            )
+        except (OSError, ValueError) as error:
+            print(f"Error importing {args.file}: {error}")
+            return
+        finally:
+            journalbook.close()
+        for message in errors:
+            print(f"Skipped {message}")
+        print(f"Imported {count} journal entries from {args.file}")
+        return
+
+    # The menu and the backup scheduler share one journalbook, so backups see every
+    # edit. Backups read through a snapshot, so they don't hold up the menu.
+    journalbook = open_journalbook(args, background_load=True, background_writes=True)
 
     # Schedule automated backups
     schedule.every().day.at("23:59").do(journalbook.perform_backup)
 
     # Initialize the Menu class and create the scheduler thread
-    menu = Menu()
+    menu = Menu(args.storage, journalbook)
     menu.scheduler_thread = threading.Thread(target=schedule_jobs, args=(menu,))
     menu.scheduler_thread.start()
 
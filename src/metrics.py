@@ -0,0 +1,363 @@
+import functools
+import inspect
+import os
+import threading
+import time
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0)
+
+# The JournalBook methods timed when instrumentation is on
+INSTRUMENTED_METHODS = (
+    "load_entries",
+    "save_entries",
+    "compact",
+    "bulk_import",
+    "new_journal",
+    "update_journal",
+    "delete_journal",
+    "search_journal",
+    "ranked_search",
+    "regex_search",
+    "parallel_search",
+    "fuzzy_search",
+    "fuzzy_search_by_tags",
+    "search_by_date",
+    "search_by_tags",
+    "query_tags",
+    "export_entries",
+    "perform_backup",
+)
+
+
+class Histogram:
+    """Count how many observations fall into each latency bucket"""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.maximum = 0.0
+
+    def observe(self, seconds):
+        """
+        Record one observation.
+
+        :param seconds: How long the call took.
+        :type seconds: float
+
+        :return: None
+        :rtype: None
+        """
+        position = 0
+        while position < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[position]:
+            position += 1
+        self.counts[position] += 1
+        self.count += 1
+        self.total += seconds
+        self.maximum = max(self.maximum, seconds)
+
+    def cumulative(self):
+        """
+        Count the observations at or below each bucket's upper bound.
+
+        :return: (upper bound, count) pairs, ending with infinity and the total count.
+        :rtype: list
+        """
+        pairs = []
+        running = 0
+        for bound, count in zip((*LATENCY_BUCKETS, float("inf")), self.counts):
+            running += count
+            pairs.append((bound, running))
+        return pairs
+
+
+class Metrics:
+    """
+    Collect call counts, latency histograms and bytes read and written for a JournalBook.
+
+    Nothing is collected unless a JournalBook is created with instrument=True, which
+    calls instrument to wrap its methods and storage. An uninstrumented book runs
+    exactly the same code as before, so turning instrumentation off costs nothing.
+
+    Time spent in a method includes any instrumented method it calls; a ranked
+    search_journal is counted under both search_journal and ranked_search.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.bytes_read = {}
+        self.bytes_written = {}
+
+    def observe(self, name, seconds, failed=False):
+        """
+        Record a call to a method.
+
+        :param name: The method's name.
+        :type name: str
+        :param seconds: How long the call took.
+        :type seconds: float
+        :param failed: Optional. Whether the call raised an exception.
+        :type failed: bool
+
+        :return: None
+        :rtype: None
+        """
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+            if failed:
+                histogram.errors += 1
+
+    def count_bytes(self, counters, kind, count):
+        """
+        Add to a bytes read or written counter.
+
+        :param counters: bytes_read or bytes_written.
+        :type counters: dict
+        :param kind: What was read or written, such as 'snapshot' or 'export'.
+        :type kind: str
+        :param count: The number of bytes.
+        :type count: int
+
+        :return: None
+        :rtype: None
+        """
+        with self.lock:
+            counters[kind] = counters.get(kind, 0) + count
+
+    def timed(self, name, function, after=None):
+        """
+        Wrap a function so every call to it is timed.
+
+        :param name: The name to record the calls under.
+        :type name: str
+        :param function: The function to wrap.
+        :type function: callable
+        :param after: Optional. Called with the call's bound arguments and result once
+            it returns, to count the bytes it read or wrote.
+        :type after: callable
+
+        :return: The wrapped function.
+        :rtype: callable
+        """
+        signature = inspect.signature(function) if after is not None else None
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = function(*args, **kwargs)
+            except BaseException:
+                self.observe(name, time.perf_counter() - start, failed=True)
+                raise
+            self.observe(name, time.perf_counter() - start)
+            if after is not None:
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                after(bound.arguments, result)
+            return result
+
+        return wrapper
+
+    def instrument(self, journalbook):
+        """
+        Start collecting metrics for a journalbook.
+
+        The journalbook's methods listed in INSTRUMENTED_METHODS are replaced on the
+        instance with timed versions. The storage's fetch, commit and compact are
+        wrapped to count the bytes they read and write, and exports and backups count
+        the size of the files they write.
+
+        :param journalbook: The journalbook to instrument.
+        :type journalbook: JournalBook
+
+        :return: None
+        :rtype: None
+        """
+        storage = journalbook.storage
+
+        def loaded(arguments, result):
+            self.count_bytes(self.bytes_read, "storage", storage_size(storage))
+
+        def exported(arguments, result):
+            if arguments["directory"]:
+                path = os.path.join(arguments["directory"], arguments["filename"])
+                if os.path.exists(path):
+                    self.count_bytes(self.bytes_written, "export", os.path.getsize(path))
+
+        def backed_up(arguments, result):
+            if result is not None:
+                path = os.path.join(arguments["directory"], result["file"])
+                self.count_bytes(self.bytes_written, "backup", os.path.getsize(path))
+
+        hooks = {
+            "load_entries": loaded,
+            "export_entries": exported,
+            "perform_backup": backed_up,
+        }
+        self.time_methods(journalbook, hooks)
+
+        fetch = storage.fetch
+
+        def counted_fetch(location):
+            # Only JSON locations say how many bytes they cover
+            if isinstance(location, tuple):
+                self.count_bytes(self.bytes_read, "fetch", location[1])
+            return fetch(location)
+
+        commit = storage.commit
+
+        def counted_commit():
+            # Only JSON storage queues its records as text
+            pending = getattr(storage, "pending", ())
+            if pending:
+                self.count_bytes(
+                    self.bytes_written,
+                    "log",
+                    sum(len(record.encode("utf-8")) for record in pending),
+                )
+            return commit()
+
+        compact = storage.compact
+
+        def counted_compact(entries, text_index=None):
+            result = compact(entries, text_index)
+            if hasattr(storage, "log_file"):
+                self.count_bytes(self.bytes_written, "snapshot", storage_size(storage))
+            return result
+
+        storage.fetch = counted_fetch
+        storage.commit = counted_commit
+        storage.compact = counted_compact
+
+    def time_methods(self, journalbook, hooks=None):
+        """
+        Replace a journalbook's methods listed in INSTRUMENTED_METHODS with timed versions.
+
+        instrument calls this. JournalBook also calls it on each ReadView it publishes,
+        so reads served from the view are recorded with the book's own.
+
+        :param journalbook: The journalbook or ReadView whose methods to time.
+        :type journalbook: JournalBook
+        :param hooks: Optional. Functions to pass as after to timed, by method name.
+        :type hooks: dict
+
+        :return: None
+        :rtype: None
+        """
+        hooks = hooks or {}
+        for name in INSTRUMENTED_METHODS:
+            setattr(
+                journalbook,
+                name,
+                self.timed(name, getattr(journalbook, name), hooks.get(name)),
+            )
+
+    def stats(self):
+        """
+        Report the metrics collected so far.
+
+        :return: "operations", with the calls, errors, total, mean and maximum seconds
+            and cumulative latency buckets of each instrumented method that has been
+            called, and "bytes_read" and "bytes_written", by kind.
+        :rtype: dict
+        """
+        with self.lock:
+            operations = {
+                name: {
+                    "calls": histogram.count,
+                    "errors": histogram.errors,
+                    "total_seconds": histogram.total,
+                    "mean_seconds": histogram.total / histogram.count,
+                    "max_seconds": histogram.maximum,
+                    "buckets": {
+                        "+Inf" if bound == float("inf") else str(bound): count
+                        for bound, count in histogram.cumulative()
+                    },
+                }
+                for name, histogram in sorted(self.histograms.items())
+            }
+            return {
+                "operations": operations,
+                "bytes_read": dict(self.bytes_read),
+                "bytes_written": dict(self.bytes_written),
+            }
+
+
+def storage_size(storage):
+    """
+    Measure the files a storage backend keeps on disk.
+
+    :param storage: The storage backend.
+    :type storage: JsonStorage or SqliteStorage
+
+    :return: The total size of its files, in bytes.
+    :rtype: int
+    """
+    paths = [storage.storage_file]
+    for name in ("log_file", "index_file"):
+        if hasattr(storage, name):
+            paths.append(getattr(storage, name))
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def prometheus_text(stats):
+    """
+    Format JournalBook.stats output in the Prometheus text exposition format.
+
+    :param stats: The report from JournalBook.stats.
+    :type stats: dict
+
+    :return: The metrics, one sample per line.
+    :rtype: str
+    """
+    lines = [
+        "# HELP scribe_entries Journal entries in the book.",
+        "# TYPE scribe_entries gauge",
+        f"scribe_entries {stats['entries']}",
+    ]
+    cache = stats["cache"]
+    for name, kind in (
+        ("hits", "counter"),
+        ("misses", "counter"),
+        ("evictions", "counter"),
+        ("invalidations", "counter"),
+        ("size", "gauge"),
+    ):
+        suffix = "_total" if kind == "counter" else ""
+        lines += [
+            f"# TYPE scribe_cache_{name}{suffix} {kind}",
+            f"scribe_cache_{name}{suffix} {cache[name]}",
+        ]
+    operations = stats.get("operations")
+    if operations:
+        lines += [
+            "# HELP scribe_operation_seconds Time taken by JournalBook methods.",
+            "# TYPE scribe_operation_seconds histogram",
+        ]
+        for name, operation in operations.items():
+            for bound, count in operation["buckets"].items():
+                lines.append(
+                    f'scribe_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {count}'
+                )
+            lines += [
+                f'scribe_operation_seconds_sum{{operation="{name}"}} {operation["total_seconds"]}',
+                f'scribe_operation_seconds_count{{operation="{name}"}} {operation["calls"]}',
+            ]
+        lines.append("# TYPE scribe_operation_errors_total counter")
+        for name, operation in operations.items():
+            lines.append(
+                f'scribe_operation_errors_total{{operation="{name}"}} {operation["errors"]}'
+            )
+    for direction in ("read", "written"):
+        counters = stats.get(f"bytes_{direction}")
+        if counters:
+            lines.append(f"# TYPE scribe_bytes_{direction}_total counter")
+            for kind, count in sorted(counters.items()):
+                lines.append(f'scribe_bytes_{direction}_total{{kind="{kind}"}} {count}')
+    return "\n".join(lines) + "\n"
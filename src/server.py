@@ -0,0 +1,449 @@
+import datetime
+import inspect
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+
+from scribe import Journal
+
+# JSON-RPC 2.0 error codes
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+APPLICATION_ERROR = -32000
+
+
+class RpcError(Exception):
+    """An error returned by a Scribe server"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def clean_tags(tags):
+    """Turn a list or comma-separated string of tags into a list of stripped tags"""
+    if isinstance(tags, str):
+        tags = tags.split(",")
+    return [tag.strip() for tag in tags if tag.strip()]
+
+
+def check_entry_params(memo, tags):
+    """
+    Check the memo and tags sent to add or replace an entry.
+
+    :param memo: The entry's memo.
+    :type memo: object
+    :param tags: The entry's tags.
+    :type tags: object
+
+    :return: None
+    :rtype: None
+
+    :raises RpcError: If the memo isn't a string, or the tags aren't a string or a
+        list of strings.
+    """
+    if not isinstance(memo, str):
+        raise RpcError(INVALID_PARAMS, "memo must be a string")
+    if not isinstance(tags, str) and not (
+        isinstance(tags, (list, tuple)) and all(isinstance(tag, str) for tag in tags)
+    ):
+        raise RpcError(INVALID_PARAMS, "tags must be a string or a list of strings")
+
+
+def parse_date(value):
+    """Turn a YYYY-MM-DD string into a date, passing None through"""
+    if value is None:
+        return None
+    return datetime.date.fromisoformat(value)
+
+
+class JournalService:
+    """
+    Answer JSON-RPC 2.0 requests against one JournalBook.
+
+    The service keeps the journalbook, with its indexes and query cache, loaded for as
+    long as it runs, so each request only pays for the work it asks for. Entries are
+    sent and returned as journal entry dictionaries, with dates as YYYY-MM-DD strings.
+
+    get, list, count and search read the journalbook's published ReadView rather than
+    the book, so they don't take its lock and can run while a write is applied. They
+    see every write that has been committed.
+
+    The methods are add, get, update, delete, list, count, search, export, backup,
+    stats and metrics. Parameters can be given by name or by position.
+    """
+
+    def __init__(self, journalbook):
+        """
+        Initialise the service.
+
+        :param journalbook: The journalbook to serve.
+        :type journalbook: JournalBook
+        """
+        self.journalbook = journalbook
+        journalbook.publish_read_view()
+        self.methods = {
+            "add": self.add,
+            "get": self.get,
+            "update": self.update,
+            "delete": self.delete,
+            "list": self.list,
+            "count": self.count,
+            "search": self.search,
+            "export": self.export,
+            "backup": self.backup,
+            "stats": self.stats,
+            "metrics": self.metrics,
+        }
+
+    def add(self, memo, tags=()):
+        """Add a journal entry and return it"""
+        check_entry_params(memo, tags)
+        with self.journalbook.lock:
+            self.journalbook.new_journal(memo, clean_tags(tags))
+            return self.journalbook.get_entry_dict(Journal.last_id)
+
+    def get(self, id):
+        """Return a journal entry, or None if there is no entry with that ID"""
+        return self.journalbook.read_view.get_entry_dict(id)
+
+    def update(self, id, memo, tags=()):
+        """Replace a journal entry's memo and tags, and return whether it existed"""
+        check_entry_params(memo, tags)
+        return self.journalbook.update_journal(id, memo, clean_tags(tags))
+
+    def delete(self, id):
+        """Delete a journal entry, and return whether it existed"""
+        return self.journalbook.delete_journal(id)
+
+    def list(self, offset=0, limit=10, order="asc"):
+        """Return a page of journal entries"""
+        view = self.journalbook.read_view
+        return [
+            view.journal_to_dict(journal)
+            for journal in view.iter_journals(offset, limit, order)
+        ]
+
+    def count(self):
+        """Return the number of journal entries"""
+        return self.journalbook.read_view.count_journals()
+
+    def search(
+        self,
+        query=None,
+        mode="ranked",
+        limit=10,
+        fold=True,
+        tags=None,
+        start_date=None,
+        end_date=None,
+        max_distance=2,
+    ):
+        """
+        Search journal entries, optionally within a date range and tag query.
+
+        :param query: Optional. The text to search for. Without it, every entry that
+            passes the filters is returned.
+        :type query: str
+        :param mode: Optional. 'index', 'substring', 'ranked', 'regex' or 'fuzzy'.
+            Default is 'ranked'.
+        :type mode: str
+        :param limit: Optional. The most entries to return, or None for all of them.
+            Default is 10.
+        :type limit: int
+        :param fold: Optional. Ignore case and accents. Default is True.
+        :type fold: bool
+        :param tags: Optional. Only return entries matching this tag query.
+        :type tags: str
+        :param start_date: Optional. Only return entries created on or after this date.
+        :type start_date: str
+        :param end_date: Optional. Only return entries created on or before this date.
+        :type end_date: str
+        :param max_distance: Optional. In fuzzy mode, how many typos to allow in each
+            word. Default is 2.
+        :type max_distance: int
+
+        :return: The matching journal entry dictionaries.
+        :rtype: list
+        """
+        # One view throughout, so the filters and the search see the same entries
+        view = self.journalbook.read_view
+        start_date = parse_date(start_date)
+        end_date = parse_date(end_date)
+        filtered = start_date is not None or end_date is not None or bool(tags)
+        allowed = view.select_ids(start_date, end_date, tags) if filtered else None
+        if not query:
+            ids = allowed if filtered else view.page_ids(0, limit)
+            journals = (view.get_journal_by_id(journal_id) for journal_id in ids)
+        else:
+            # Filtering happens after the search, so ask for every match
+            search_limit = None if filtered else limit
+            if mode == "fuzzy":
+                journals = view.fuzzy_search(query, max_distance, search_limit)
+            else:
+                journals = view.search_journal(query, mode, search_limit, fold)
+            if filtered:
+                allowed = set(allowed)
+                journals = (journal for journal in journals if journal.id in allowed)
+        results = []
+        for journal in journals:
+            if journal is None:
+                continue
+            if limit is not None and len(results) >= limit:
+                break
+            results.append(view.journal_to_dict(journal))
+        return results
+
+    def export(
+        self,
+        filename,
+        file_format="json",
+        directory=None,
+        compress=False,
+        start_date=None,
+        end_date=None,
+        tags=None,
+    ):
+        """Export journal entries to a file, and return the file's path"""
+        directory = directory or os.getcwd()
+        self.journalbook.export_entries(
+            filename,
+            file_format,
+            directory,
+            compress,
+            parse_date(start_date),
+            parse_date(end_date),
+            tags,
+        )
+        return os.path.join(directory, filename)
+
+    def backup(self, directory="backups", full=False):
+        """Back up the journal, and return the new backup's manifest record or None"""
+        return self.journalbook.perform_backup(directory, full)
+
+    def stats(self):
+        """Return JournalBook.stats"""
+        return self.journalbook.stats()
+
+    def metrics(self):
+        """Return JournalBook.stats in the Prometheus text format"""
+        return self.journalbook.metrics_text()
+
+    def handle(self, request):
+        """
+        Answer a single JSON-RPC request.
+
+        :param request: The decoded request.
+        :type request: object
+
+        :return: The response, or None if the request was a notification, which has
+            no id and gets no response.
+        :rtype: dict or None
+        """
+        if not isinstance(request, dict) or not isinstance(request.get("method"), str):
+            return error_response(None, INVALID_REQUEST, "Invalid request")
+        request_id = request.get("id")
+        method = self.methods.get(request["method"])
+        params = request.get("params", {})
+        try:
+            if method is None:
+                raise RpcError(METHOD_NOT_FOUND, f"Unknown method {request['method']}")
+            if isinstance(params, dict):
+                args, kwargs = (), params
+            elif isinstance(params, list):
+                args, kwargs = params, {}
+            else:
+                raise RpcError(INVALID_PARAMS, "params must be an object or an array")
+            try:
+                inspect.signature(method).bind(*args, **kwargs)
+            except TypeError as error:
+                raise RpcError(INVALID_PARAMS, str(error))
+            result = method(*args, **kwargs)
+        except RpcError as error:
+            response = error_response(request_id, error.code, str(error))
+        except Exception as error:
+            # Answer with an error rather than letting one request stop the server
+            response = error_response(request_id, APPLICATION_ERROR, str(error))
+        else:
+            response = {"jsonrpc": "2.0", "result": result, "id": request_id}
+        return response if "id" in request else None
+
+    def handle_line(self, line):
+        """
+        Answer one line of a JSON-RPC stream.
+
+        :param line: A JSON request, or a JSON array of requests to answer as a batch.
+        :type line: str
+
+        :return: The JSON response, or None if there is nothing to send back.
+        :rtype: str or None
+        """
+        if not line.strip():
+            return None
+        try:
+            request = json.loads(line)
+        except ValueError as error:
+            return json.dumps(error_response(None, PARSE_ERROR, f"Parse error: {error}"))
+        if isinstance(request, list):
+            responses = [self.handle(item) for item in request]
+            responses = [response for response in responses if response is not None]
+            if not request:
+                responses = error_response(None, INVALID_REQUEST, "Empty batch")
+            return json.dumps(responses) if responses else None
+        response = self.handle(request)
+        return None if response is None else json.dumps(response)
+
+    def serve_stream(self, reader, writer):
+        """
+        Answer requests from a stream, one per line, until it ends.
+
+        :param reader: Where requests are read from.
+        :type reader: file
+        :param writer: Where responses are written, one per line.
+        :type writer: file
+
+        :return: None
+        :rtype: None
+        """
+        for line in reader:
+            response = self.handle_line(line)
+            if response is not None:
+                writer.write(response + "\n")
+                writer.flush()
+
+
+def error_response(request_id, code, message):
+    """Build a JSON-RPC error response"""
+    return {"jsonrpc": "2.0", "error": {"code": code, "message": message}, "id": request_id}
+
+
+def serve_stdio(service):
+    """
+    Answer requests on standard input until it is closed.
+
+    Responses are written to standard output. Anything the journalbook prints while
+    the server runs is sent to standard error, so it can't corrupt the responses.
+
+    :param service: The service to run.
+    :type service: JournalService
+
+    :return: None
+    :rtype: None
+    """
+    output = sys.stdout
+    sys.stdout = sys.stderr
+    try:
+        service.serve_stream(sys.stdin, output)
+    finally:
+        sys.stdout = output
+
+
+def serve_unix(service, path):
+    """
+    Answer requests on a Unix socket until interrupted or terminated.
+
+    Each connection is served on its own thread and can send any number of requests,
+    one per line. The socket is only accessible to the user running the server.
+
+    :param service: The service to run.
+    :type service: JournalService
+    :param path: Where to create the socket. A stale socket left there is replaced.
+    :type path: str
+
+    :return: None
+    :rtype: None
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            reader = (line.decode("utf-8") for line in self.rfile)
+            writer = SocketWriter(self.wfile)
+            service.serve_stream(reader, writer)
+
+    if os.path.exists(path):
+        os.remove(path)
+    previous_umask = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(path, Handler)
+    finally:
+        os.umask(previous_umask)
+    server.daemon_threads = True
+    if threading.current_thread() is threading.main_thread():
+        # Stop cleanly on SIGTERM too, so the socket is removed and changes are saved
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class SocketWriter:
+    """Write text responses to a socket's binary stream"""
+
+    def __init__(self, wfile):
+        self.wfile = wfile
+
+    def write(self, text):
+        self.wfile.write(text.encode("utf-8"))
+
+    def flush(self):
+        self.wfile.flush()
+
+
+class Client:
+    """Send requests to a Scribe server listening on a Unix socket"""
+
+    def __init__(self, path):
+        """
+        Connect to the server.
+
+        :param path: The server's socket.
+        :type path: str
+
+        :raises OSError: If the server can't be reached.
+        """
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.connect(path)
+        self.reader = self.socket.makefile("r", encoding="utf-8")
+        self.next_id = 1
+
+    def call(self, method, params=None):
+        """
+        Call a method on the server and wait for its result.
+
+        :param method: The method's name, one of JournalService's methods.
+        :type method: str
+        :param params: Optional. The method's parameters, by name.
+        :type params: dict
+
+        :return: The method's result.
+        :rtype: object
+
+        :raises RpcError: If the server returns an error.
+        """
+        request = {"jsonrpc": "2.0", "method": method, "params": params or {}}
+        request["id"] = self.next_id
+        self.next_id += 1
+        self.socket.sendall((json.dumps(request) + "\n").encode("utf-8"))
+        line = self.reader.readline()
+        if not line:
+            raise RpcError(APPLICATION_ERROR, "The server closed the connection")
+        response = json.loads(line)
+        if "error" in response:
+            raise RpcError(response["error"]["code"], response["error"]["message"])
+        return response["result"]
+
+    def close(self):
+        """Close the connection"""
+        self.reader.close()
+        self.socket.close()
@@ -0,0 +1,187 @@
+import datetime
+import os
+import pickle
+import re
+
+from indexes import normalize
+
+# Shards read by each worker process, by path, with the file's size and modification
+# time so a shard that has been rewritten is read again
+loaded_shards = {}
+
+
+def month_key(creation_date):
+    """
+    Name the shard a journal entry belongs to.
+
+    :param creation_date: The entry's creation date, as a date or a YYYY-MM-DD string.
+    :type creation_date: datetime.date or str
+
+    :return: The entry's month, as YYYY-MM.
+    :rtype: str
+    """
+    if isinstance(creation_date, datetime.date):
+        creation_date = creation_date.isoformat()
+    return creation_date[:7]
+
+
+def month_range(month):
+    """
+    Find the first and last days of a month.
+
+    :param month: The month, as YYYY-MM.
+    :type month: str
+
+    :return: The first and last dates in the month.
+    :rtype: tuple
+    """
+    year, number = (int(part) for part in month.split("-"))
+    start = datetime.date(year, number, 1)
+    if number == 12:
+        following = datetime.date(year + 1, 1, 1)
+    else:
+        following = datetime.date(year, number + 1, 1)
+    return start, following - datetime.timedelta(days=1)
+
+
+class ShardSet:
+    """
+    Keep a copy of a journal's entries split into one file per month, for parallel search.
+
+    Each shard is a pickled list of (id, memo, tags) rows in ID order, so a worker
+    process can load it without parsing JSON or building Journal objects. The shards
+    are a cache: JournalBook marks a month as dirty whenever an entry in it changes,
+    and rewrites the dirty shards before the next parallel search.
+    """
+
+    def __init__(self, directory):
+        """
+        Initialise the shard set.
+
+        :param directory: Where the shard files are kept.
+        :type directory: str
+        """
+        self.directory = directory
+        self.dirty = set()
+
+    def path(self, month):
+        """Return the path of a month's shard file"""
+        return os.path.join(self.directory, f"{month}.pickle")
+
+    def mark(self, creation_date):
+        """
+        Mark the shard holding an entry as out of date.
+
+        :param creation_date: The entry's creation date.
+        :type creation_date: datetime.date or str
+
+        :return: None
+        :rtype: None
+        """
+        self.dirty.add(month_key(creation_date))
+
+    def write(self, month, rows):
+        """
+        Replace a month's shard.
+
+        :param month: The month, as YYYY-MM.
+        :type month: str
+        :param rows: The (id, memo, tags) rows of every entry in the month, in ID order.
+            If there are none, the shard is deleted.
+        :type rows: list
+
+        :return: None
+        :rtype: None
+        """
+        path = self.path(month)
+        if not rows:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        with open(path + ".tmp", "wb") as file:
+            pickle.dump(rows, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + ".tmp", path)
+
+    def clear(self):
+        """Delete every shard file, creating the directory if it doesn't exist"""
+        os.makedirs(self.directory, exist_ok=True)
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".pickle"):
+                os.remove(os.path.join(self.directory, filename))
+        self.dirty.clear()
+
+    def paths(self):
+        """
+        List the shard files.
+
+        :return: The path of every shard, oldest month first.
+        :rtype: list
+        """
+        return [
+            os.path.join(self.directory, filename)
+            for filename in sorted(os.listdir(self.directory))
+            if filename.endswith(".pickle")
+        ]
+
+
+def load_shard(path):
+    """
+    Read a shard, reusing the copy this process read last time if it hasn't changed.
+
+    :param path: The shard file.
+    :type path: str
+
+    :return: The shard's (id, memo, tags) rows.
+    :rtype: list
+    """
+    status = os.stat(path)
+    stamp = (status.st_size, status.st_mtime_ns)
+    cached = loaded_shards.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+    with open(path, "rb") as file:
+        rows = pickle.load(file)
+    loaded_shards[path] = (stamp, rows)
+    return rows
+
+
+def search_shard(path, pattern, mode="substring", fold=False):
+    """
+    Find the entries in a shard that match a pattern.
+
+    This runs in a worker process, so it takes and returns only plain values.
+
+    :param path: The shard file.
+    :type path: str
+    :param pattern: The text or regular expression to search for.
+    :type pattern: str
+    :param mode: Optional. 'substring' matches as Journal.match does, and 'regex'
+        as Journal.match_regex does. Default is 'substring'.
+    :type mode: str
+    :param fold: Optional. Ignore case and accents in substring mode, or case in regex
+        mode. Default is False.
+    :type fold: bool
+
+    :return: The IDs of the matching entries, in ID order.
+    :rtype: list
+    """
+    rows = load_shard(path)
+    if mode == "regex":
+        search = re.compile(pattern, re.IGNORECASE if fold else 0).search
+        return [
+            journal_id
+            for journal_id, memo, tags in rows
+            if search(memo) or any(search(tag) for tag in tags)
+        ]
+    if fold:
+        pattern = normalize(pattern)
+        return [
+            journal_id
+            for journal_id, memo, tags in rows
+            if any(pattern in normalize(text) for text in (memo, *tags))
+        ]
+    return [
+        journal_id
+        for journal_id, memo, tags in rows
+        if pattern in memo or any(pattern in tag for tag in tags)
+    ]
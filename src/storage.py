@@ -0,0 +1,1057 @@
+import datetime
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import sys
+import threading
+from array import array
+from json.encoder import encode_basestring_ascii
+
+from indexes import InvertedIndex, tokenize
+
+ENTRY_FIELDS = {"memo", "tags", "creation_date", "id"}
+ENTRY_FORMAT = '{"memo": %s, "tags": [%s], "creation_date": %s, "id": %d}'
+
+
+def encode_entry(entry):
+    """
+    Encode a journal entry dictionary as JSON, as json.dumps would.
+
+    Entries with the usual fields and types are formatted directly, which is about
+    twice as fast as json.dumps; anything else is passed to json.dumps.
+
+    :param entry: The journal entry dictionary.
+    :type entry: dict
+
+    :return: The JSON text.
+    :rtype: str
+    """
+    if (
+        entry.keys() == ENTRY_FIELDS
+        and type(entry["id"]) is int
+        and isinstance(entry["tags"], list)
+    ):
+        try:
+            return ENTRY_FORMAT % (
+                encode_basestring_ascii(entry["memo"]),
+                ", ".join(map(encode_basestring_ascii, entry["tags"])),
+                encode_basestring_ascii(entry["creation_date"]),
+                entry["id"],
+            )
+        except TypeError:
+            pass
+    return json.dumps(entry)
+
+
+def open_storage(storage_file):
+    """
+    Choose a storage backend for a journal file from its extension.
+
+    Files ending in .db, .sqlite or .sqlite3 are stored in SQLite, and files ending
+    in .bin in the binary snapshot format. Anything else is stored as a JSON snapshot
+    with a write-ahead log.
+
+    :param storage_file: The path of the journal file.
+    :type storage_file: str
+
+    :return: The storage backend for the file.
+    :rtype: JsonStorage, BinaryStorage or SqliteStorage
+    """
+    extension = os.path.splitext(storage_file)[1].lower()
+    if extension in (".db", ".sqlite", ".sqlite3"):
+        return SqliteStorage(storage_file)
+    if extension == ".bin":
+        return BinaryStorage(storage_file)
+    return JsonStorage(storage_file)
+
+
+class JsonStorage:
+    """Store journals as a JSON snapshot plus an append-only write-ahead log"""
+
+    def __init__(self, storage_file):
+        """
+        Initialise the storage.
+
+        :param storage_file: The path of the JSON snapshot. The log and keyword index
+            are kept next to it with .log and .index extensions.
+        :type storage_file: str
+        """
+        self.storage_file = storage_file
+        self.log_file = os.path.splitext(storage_file)[0] + ".log"
+        self.index_file = os.path.splitext(storage_file)[0] + ".index"
+        self.compact_threshold = 1000
+        self.log_records = 0
+        self.log_torn = False
+        # Lines of the snapshot iter_entries couldn't parse, which compact must not lose
+        self.skipped_lines = 0
+        self.pending = []
+        self.reader = None
+        self.reader_lock = threading.Lock()
+
+    def iter_entries(self, memos=True):
+        """
+        Stream the journal entries in the snapshot.
+
+        Snapshots are written with one entry per line, so they are parsed a line at a
+        time and each entry's byte offset and length are reported alongside it. The
+        entry can be read back later with fetch. Snapshots written by older versions of
+        Scribe, which spread entries over several lines, are parsed in one go instead,
+        and their entries have no location.
+
+        A line that isn't valid JSON is skipped with an error message, and the entries
+        after it are still read. The damaged snapshot is kept by the next compact.
+
+        :param memos: Optional. Ignored; entries are parsed whole, so they always
+            include their memo.
+        :type memos: bool
+
+        :return: A generator of (entry dictionary, location) pairs.
+        :rtype: generator
+        """
+        if not os.path.exists(self.storage_file):
+            return
+        with open(self.storage_file, "rb") as file:
+            if file.readline().strip() == b"[":
+                offset = file.tell()
+                for line_number, line in enumerate(file):
+                    entry_bytes = line.rstrip(b",\r\n")
+                    if entry_bytes == b"]":
+                        return
+                    if entry_bytes:
+                        try:
+                            entry = json.loads(entry_bytes)
+                        except (json.JSONDecodeError, UnicodeDecodeError):
+                            if line_number == 0:
+                                break  # An older, multi-line snapshot
+                            # The first line of the file is the opening bracket
+                            print(
+                                f"Error: Skipped line {line_number + 2} of "
+                                f"{self.storage_file}, which isn't valid JSON."
+                            )
+                            self.skipped_lines += 1
+                        else:
+                            yield entry, (offset, len(entry_bytes))
+                    offset += len(line)
+                else:
+                    return
+        for entry in self.load_whole_snapshot():
+            yield entry, None
+
+    def load_whole_snapshot(self):
+        """
+        Parse the whole snapshot at once.
+
+        :return: A list of journal entry dictionaries.
+        :rtype: list
+        """
+        with open(self.storage_file, "r") as file:
+            try:
+                return json.load(file)
+            except json.JSONDecodeError:
+                print(
+                    "Error: Unable to load JSON data. The file may be empty or contain invalid JSON."
+                )
+                return []
+
+    def fetch(self, location):
+        """
+        Read a single journal entry back from the snapshot.
+
+        :param location: The (offset, length) reported by iter_entries or compact.
+        :type location: tuple
+
+        :return: The journal entry dictionary.
+        :rtype: dict
+        """
+        offset, length = location
+        with self.reader_lock:
+            if self.reader is None:
+                self.reader = open(self.storage_file, "rb")
+            self.reader.seek(offset)
+            return json.loads(self.reader.read(length))
+
+    def close_reader(self):
+        """Close the handle fetch uses to read the snapshot"""
+        with self.reader_lock:
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
+
+    def load_log(self):
+        """
+        Load the records written to the log since the snapshot.
+
+        A torn final record, left by a write that was interrupted, is dropped and
+        flagged so the book is compacted before anything else is appended after it.
+
+        :return: A list of log records.
+        :rtype: list
+        """
+        records = []
+        if os.path.exists(self.log_file):
+            with open(self.log_file, "r") as file:
+                for line in file:
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        self.log_torn = True
+                        break
+        self.log_records = len(records)
+        return records
+
+    def snapshot_stamp(self):
+        """
+        Identify the current snapshot file by its size and modification time.
+
+        :return: The stamp, or None if there is no snapshot yet.
+        :rtype: list or None
+        """
+        if not os.path.exists(self.storage_file):
+            return None
+        stat = os.stat(self.storage_file)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def load_text_index(self):
+        """
+        Load the keyword index saved with the snapshot.
+
+        The index is only trusted if it was written for the current snapshot.
+
+        :return: The keyword index, or None if it needs rebuilding.
+        :rtype: InvertedIndex or None
+        """
+        if not os.path.exists(self.index_file):
+            return None
+        with open(self.index_file, "r") as file:
+            try:
+                data = json.load(file)
+            except json.JSONDecodeError:
+                return None
+        # Indexes saved by older versions have no term counts, so can't be used for ranking
+        if data.get("snapshot") != self.snapshot_stamp() or "lengths" not in data:
+            return None
+        return InvertedIndex.from_dict(data)
+
+    def append(self, record):
+        """
+        Queue a mutation record to be written to the log on the next commit.
+
+        :param record: The record, with an "op" of "add", "update" or "delete".
+        :type record: dict
+
+        :return: None
+        :rtype: None
+        """
+        self.pending.append(json.dumps(record) + "\n")
+
+    def commit(self):
+        """Append every queued record to the log in a single write"""
+        if not self.pending:
+            return
+        with open(self.log_file, "a") as file:
+            file.write("".join(self.pending))
+        self.log_records += len(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        """Drop the records queued since the last commit"""
+        self.pending = []
+
+    def needs_compaction(self, journal_count, incoming=0):
+        """
+        Check whether the log should be folded into a new snapshot.
+
+        Compaction waits until the log holds at least compact_threshold records, and
+        at least as many records as there are journals, which keeps its cost amortised
+        to O(1) per mutation.
+
+        :param journal_count: The number of journals in the book.
+        :type journal_count: int
+        :param incoming: Optional. The number of records about to be appended.
+        :type incoming: int
+
+        :return: True if the book should be compacted.
+        :rtype: bool
+        """
+        return self.log_torn or self.log_records + incoming >= max(
+            self.compact_threshold, journal_count
+        )
+
+    def compact(self, entries, text_index=None):
+        """
+        Write a fresh snapshot and keyword index, then clear the log.
+
+        The snapshot is still a JSON array, but with one entry per line so it can be
+        streamed back by iter_entries. It is written to a temporary file and swapped in
+        with os.replace, so a crash part-way through leaves the previous snapshot and
+        log untouched. If iter_entries skipped any damaged lines, the old snapshot is
+        first copied to a .damaged file next to it, so they can still be recovered.
+
+        :param entries: The journal entry dictionaries to write. They may be read
+            lazily from the current snapshot with fetch.
+        :type entries: iterable
+        :param text_index: Optional. The keyword index to save with the snapshot.
+        :type text_index: InvertedIndex, optional
+
+        :return: The location of each entry in the new snapshot, in the same order.
+        :rtype: list
+        """
+        if self.skipped_lines:
+            damaged_file = self.storage_file + ".damaged"
+            shutil.copyfile(self.storage_file, damaged_file)
+            print(f"The unreadable lines are kept in {damaged_file}.")
+            self.skipped_lines = 0
+        temp_file = self.storage_file + ".tmp"
+        locations = []
+        with open(temp_file, "wb") as file:
+            file.write(b"[\n")
+            offset = 2
+            for entry in entries:
+                if locations:
+                    file.write(b",\n")
+                    offset += 2
+                entry_bytes = encode_entry(entry).encode("utf-8")
+                file.write(entry_bytes)
+                locations.append((offset, len(entry_bytes)))
+                offset += len(entry_bytes)
+            file.write(b"\n]\n")
+        self.close_reader()
+        os.replace(temp_file, self.storage_file)
+        if text_index is not None:
+            self.save_text_index(text_index)
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.log_records = 0
+        self.log_torn = False
+        self.pending = []
+        return locations
+
+    def save_text_index(self, text_index):
+        """
+        Save the keyword index, stamped with the snapshot it belongs to.
+
+        :param text_index: The keyword index to save.
+        :type text_index: InvertedIndex
+
+        :return: None
+        :rtype: None
+        """
+        temp_file = self.index_file + ".tmp"
+        with open(temp_file, "w") as file:
+            # json.dumps uses the C encoder; json.dump streaming to a file does not
+            file.write(
+                json.dumps({"snapshot": self.snapshot_stamp(), **text_index.to_dict()})
+            )
+        os.replace(temp_file, self.index_file)
+
+    def close(self):
+        """Write any queued records and close the snapshot reader"""
+        self.commit()
+        self.close_reader()
+
+
+class BinaryStorage(JsonStorage):
+    """
+    Store journals as a binary snapshot, read through mmap, plus a write-ahead log.
+
+    The snapshot is laid out so a book can be opened without decoding any memos:
+
+    - A header with a magic number, the number of entries and tag references, the
+      number of distinct tags, and where the tag names and memo heap start.
+    - A table of fixed-width records, one per entry, holding its ID, ordinal creation
+      date, the position and number of its tag references, and the offset and length
+      of its memo in the heap.
+    - The tag references, each the position of a tag in the list of tag names.
+    - The distinct tag names, each a UTF-8 string prefixed with its length.
+    - The memo heap, every memo as UTF-8, one after another.
+
+    Loading reads the record table and tag references in bulk and decodes each tag
+    name once. A memo is only decoded when fetch asks for its entry. The keyword index
+    is saved in a binary layout of its own too (see save_text_index), which loads
+    without parsing JSON. The log works as it does for JsonStorage.
+    """
+
+    MAGIC = b"SCRIBEB2"
+    # Magic number, entries, tag references, tag names, offset of the tag names,
+    # offset of the memo heap
+    HEADER = struct.Struct("<8sQQQQQ")
+    # ID, ordinal creation date, first tag reference, number of tags, memo length,
+    # memo offset in the heap
+    RECORD = struct.Struct("<qiIIIQ")
+    LENGTH = struct.Struct("<I")
+    INDEX_MAGIC = b"SCRIBEI1"
+    # Magic number, snapshot size and modification time, tokens, posted IDs, counted
+    # IDs, journal lengths, bytes of token names
+    INDEX_HEADER = struct.Struct("<8sqqQQQQQ")
+
+    def __init__(self, storage_file):
+        """
+        Initialise the storage.
+
+        :param storage_file: The path of the binary snapshot.
+        :type storage_file: str
+        """
+        super().__init__(storage_file)
+        # Appended rather than replacing the extension, so a JSON journal with the same
+        # name in the same directory keeps its own log and index
+        self.log_file = storage_file + ".log"
+        self.index_file = storage_file + ".index"
+        # The tag references and names of the mapped snapshot, read on first use
+        self.tag_refs = None
+        self.tag_names = None
+
+    def mapping(self):
+        """
+        Map the snapshot into memory and read its tags, if that hasn't been done yet.
+
+        Must be called with reader_lock held.
+
+        :return: The read-only mapping of the snapshot.
+        :rtype: mmap.mmap
+
+        :raises ValueError: If the file isn't a binary snapshot.
+        """
+        if self.reader is not None:
+            return self.reader
+        with open(self.storage_file, "rb") as file:
+            view = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if view[: len(self.MAGIC)] != self.MAGIC:
+            view.close()
+            raise ValueError(f"{self.storage_file} is not a binary journal")
+        _, count, ref_count, name_count, names_offset, _ = self.HEADER.unpack_from(
+            view, 0
+        )
+        refs_offset = self.HEADER.size + count * self.RECORD.size
+        self.tag_refs = array("I")
+        self.tag_refs.frombytes(
+            view[refs_offset : refs_offset + ref_count * self.tag_refs.itemsize]
+        )
+        self.tag_names = []
+        position = names_offset
+        for _ in range(name_count):
+            (length,) = self.LENGTH.unpack_from(view, position)
+            position += self.LENGTH.size
+            self.tag_names.append(
+                sys.intern(view[position : position + length].decode("utf-8"))
+            )
+            position += length
+        self.reader = view
+        return view
+
+    def close_reader(self):
+        """Unmap the snapshot"""
+        with self.reader_lock:
+            if self.reader is not None:
+                self.reader.close()
+                self.reader = None
+                self.tag_refs = None
+                self.tag_names = None
+
+    def iter_entries(self, memos=True):
+        """
+        Stream the journal entries in the snapshot.
+
+        :param memos: Optional. Decode each entry's memo. Without memos, entries are
+            read from the record table and tags alone, and have no "memo". Default is
+            True.
+        :type memos: bool
+
+        :return: A generator of (entry dictionary, location) pairs. The location is
+            the position of the entry's record and the number of bytes of its record
+            and memo.
+        :rtype: generator
+
+        :raises ValueError: If the file isn't a binary snapshot.
+        """
+        if not os.path.exists(self.storage_file):
+            return
+        with self.reader_lock:
+            view = self.mapping()
+            tag_refs, tag_names = self.tag_refs, self.tag_names
+        _, count, _, _, _, memo_heap = self.HEADER.unpack_from(view, 0)
+        table_end = self.HEADER.size + count * self.RECORD.size
+        # Dates repeat across entries, so each is formatted once
+        dates = {}
+        offset = self.HEADER.size
+        for journal_id, ordinal, first_tag, tag_count, memo_length, memo_offset in (
+            self.RECORD.iter_unpack(view[self.HEADER.size : table_end])
+        ):
+            creation_date = dates.get(ordinal)
+            if creation_date is None:
+                creation_date = dates[ordinal] = datetime.date.fromordinal(
+                    ordinal
+                ).isoformat()
+            entry = {
+                "tags": [
+                    tag_names[ref] for ref in tag_refs[first_tag : first_tag + tag_count]
+                ],
+                "creation_date": creation_date,
+                "id": journal_id,
+            }
+            if memos:
+                start = memo_heap + memo_offset
+                entry["memo"] = view[start : start + memo_length].decode("utf-8")
+            yield entry, (offset, self.RECORD.size + memo_length)
+            offset += self.RECORD.size
+
+    def fetch(self, location):
+        """
+        Decode a single journal entry from the snapshot.
+
+        :param location: The location reported by iter_entries or compact.
+        :type location: tuple
+
+        :return: The journal entry dictionary.
+        :rtype: dict
+        """
+        with self.reader_lock:
+            view = self.mapping()
+            journal_id, ordinal, first_tag, tag_count, memo_length, memo_offset = (
+                self.RECORD.unpack_from(view, location[0])
+            )
+            start = self.HEADER.unpack_from(view, 0)[5] + memo_offset
+            return {
+                "memo": view[start : start + memo_length].decode("utf-8"),
+                "tags": [
+                    self.tag_names[ref]
+                    for ref in self.tag_refs[first_tag : first_tag + tag_count]
+                ],
+                "creation_date": datetime.date.fromordinal(ordinal).isoformat(),
+                "id": journal_id,
+            }
+
+    def compact(self, entries, text_index=None):
+        """
+        Write a fresh binary snapshot and keyword index, then clear the log.
+
+        Entries are streamed: their memos go to a temporary heap file while the record
+        table is built in memory, then the parts are joined into a temporary snapshot,
+        which is swapped in with os.replace.
+
+        :param entries: The journal entry dictionaries to write. They may be read
+            lazily from the current snapshot with fetch.
+        :type entries: iterable
+        :param text_index: Optional. The keyword index to save with the snapshot.
+        :type text_index: InvertedIndex, optional
+
+        :return: The location of each entry in the new snapshot, in the same order.
+        :rtype: list
+        """
+        temp_file = self.storage_file + ".tmp"
+        heap_file = self.storage_file + ".heap.tmp"
+        records = bytearray()
+        tag_refs = array("I")
+        tag_positions = {}
+        memo_lengths = []
+        memo_offset = 0
+        with open(heap_file, "wb") as heap:
+            for entry in entries:
+                memo = entry["memo"].encode("utf-8")
+                first_tag = len(tag_refs)
+                for tag in entry["tags"]:
+                    tag_refs.append(tag_positions.setdefault(tag, len(tag_positions)))
+                records += self.RECORD.pack(
+                    entry["id"],
+                    datetime.date.fromisoformat(entry["creation_date"]).toordinal(),
+                    first_tag,
+                    len(tag_refs) - first_tag,
+                    len(memo),
+                    memo_offset,
+                )
+                heap.write(memo)
+                memo_lengths.append(len(memo))
+                memo_offset += len(memo)
+        names = b"".join(
+            self.LENGTH.pack(len(data)) + data
+            for data in (tag.encode("utf-8") for tag in tag_positions)
+        )
+        count = len(memo_lengths)
+        names_offset = self.HEADER.size + len(records) + len(tag_refs) * tag_refs.itemsize
+        with open(temp_file, "wb") as file:
+            file.write(
+                self.HEADER.pack(
+                    self.MAGIC,
+                    count,
+                    len(tag_refs),
+                    len(tag_positions),
+                    names_offset,
+                    names_offset + len(names),
+                )
+            )
+            file.write(records)
+            tag_refs.tofile(file)
+            file.write(names)
+            with open(heap_file, "rb") as heap:
+                shutil.copyfileobj(heap, file)
+        os.remove(heap_file)
+        self.close_reader()
+        os.replace(temp_file, self.storage_file)
+        if text_index is not None:
+            self.save_text_index(text_index)
+        if os.path.exists(self.log_file):
+            os.remove(self.log_file)
+        self.log_records = 0
+        self.log_torn = False
+        self.pending = []
+        return [
+            (self.HEADER.size + position * self.RECORD.size, self.RECORD.size + length)
+            for position, length in enumerate(memo_lengths)
+        ]
+
+    def load_text_index(self):
+        """
+        Load the keyword index saved with the snapshot.
+
+        The index is only trusted if it was written for the current snapshot, and its
+        sections add up to the size of the file. Nothing in it is executed, so a
+        damaged or hostile file can at worst make the index be rebuilt.
+
+        :return: The keyword index, or None if it needs rebuilding.
+        :rtype: InvertedIndex or None
+        """
+        if not os.path.exists(self.index_file):
+            return None
+        with open(self.index_file, "rb") as file:
+            data = file.read()
+        if data[: len(self.INDEX_MAGIC)] != self.INDEX_MAGIC:
+            return None
+        try:
+            (
+                _,
+                size,
+                mtime_ns,
+                token_count,
+                id_count,
+                count_count,
+                length_count,
+                names_length,
+            ) = self.INDEX_HEADER.unpack_from(data, 0)
+        except struct.error:
+            return None
+        if [size, mtime_ns] != self.snapshot_stamp():
+            return None
+        sections = [
+            ("I", token_count),
+            ("q", id_count),
+            ("I", token_count),
+            ("q", count_count),
+            ("I", count_count),
+            ("q", length_count),
+            ("I", length_count),
+        ]
+        position = self.INDEX_HEADER.size + names_length
+        section_bytes = sum(array(code).itemsize * length for code, length in sections)
+        if position + section_bytes != len(data):
+            return None
+        arrays = []
+        for code, length in sections:
+            values = array(code)
+            values.frombytes(data[position : position + values.itemsize * length])
+            position += values.itemsize * length
+            arrays.append(values.tolist())
+        (
+            id_sizes,
+            ids,
+            count_sizes,
+            count_ids,
+            count_values,
+            length_ids,
+            lengths,
+        ) = arrays
+        try:
+            names = data[self.INDEX_HEADER.size : self.INDEX_HEADER.size + names_length]
+            tokens = names.decode("utf-8").split("\0") if token_count else []
+        except UnicodeDecodeError:
+            return None
+        if (
+            len(tokens) != token_count
+            or sum(id_sizes) != id_count
+            or sum(count_sizes) != count_count
+        ):
+            return None
+        postings = {}
+        counts = {}
+        start = count_start = 0
+        for token, id_size, count_size in zip(tokens, id_sizes, count_sizes):
+            postings[token] = set(ids[start : start + id_size])
+            start += id_size
+            if count_size:
+                end = count_start + count_size
+                counts[token] = dict(
+                    zip(count_ids[count_start:end], count_values[count_start:end])
+                )
+                count_start = end
+        return InvertedIndex(postings, counts, dict(zip(length_ids, lengths)))
+
+    def save_text_index(self, text_index):
+        """
+        Save the keyword index, stamped with the snapshot it belongs to.
+
+        The file starts with a header giving the snapshot's size and modification time
+        and the length of each section, followed by:
+
+        - The tokens, as UTF-8 separated by NUL characters, which can't appear in one.
+        - The number of IDs in each token's postings, then all the IDs.
+        - The number of counted IDs for each token, then the IDs and their counts.
+        - The ID and length of every journal.
+
+        :param text_index: The keyword index to save.
+        :type text_index: InvertedIndex
+
+        :return: None
+        :rtype: None
+        """
+        tokens = list(text_index.postings)
+        names = "\0".join(tokens).encode("utf-8")
+        id_sizes = array("I", map(len, text_index.postings.values()))
+        ids = array("q")
+        for postings in text_index.postings.values():
+            ids.extend(postings)
+        no_counts = {}
+        token_counts = [text_index.counts.get(token, no_counts) for token in tokens]
+        count_sizes = array("I", map(len, token_counts))
+        count_ids = array("q")
+        count_values = array("I")
+        for counts in token_counts:
+            count_ids.extend(counts)
+            count_values.extend(counts.values())
+        size, mtime_ns = self.snapshot_stamp()
+        temp_file = self.index_file + ".tmp"
+        with open(temp_file, "wb") as file:
+            file.write(
+                self.INDEX_HEADER.pack(
+                    self.INDEX_MAGIC,
+                    size,
+                    mtime_ns,
+                    len(tokens),
+                    len(ids),
+                    len(count_ids),
+                    len(text_index.lengths),
+                    len(names),
+                )
+            )
+            file.write(names)
+            for values in (id_sizes, ids, count_sizes, count_ids, count_values):
+                values.tofile(file)
+            array("q", text_index.lengths).tofile(file)
+            array("I", text_index.lengths.values()).tofile(file)
+        os.replace(temp_file, self.index_file)
+
+
+class FtsIndex:
+    """Keyword index backed by the SQLite storage's FTS5 table"""
+
+    def __init__(self, connection):
+        """
+        Initialise the index.
+
+        :param connection: The connection to the journal database.
+        :type connection: sqlite3.Connection
+        """
+        self.connection = connection
+
+    def add(self, journal_id, tokens):
+        """The FTS5 table is kept up to date by SqliteStorage, so this does nothing."""
+
+    def add_many(self, entries):
+        """The FTS5 table is kept up to date by SqliteStorage, so this does nothing."""
+
+    def remove(self, journal_id, tokens):
+        """The FTS5 table is kept up to date by SqliteStorage, so this does nothing."""
+
+    def search(self, tokens):
+        """
+        Find the journals that contain every one of the given tokens.
+
+        FTS5 matches case-insensitively, so its candidates are re-checked against the
+        stored memo and tags to keep the case-sensitive behaviour of InvertedIndex.
+
+        :param tokens: The tokens to look up.
+        :type tokens: iterable
+
+        :return: The IDs of the matching journals.
+        :rtype: set
+        """
+        tokens = set(tokens)
+        if not tokens:
+            return set()
+        query = " ".join(f'"{token}"' for token in tokens)
+        rows = self.connection.execute(
+            "SELECT rowid, memo, tags FROM journals_fts WHERE journals_fts MATCH ?",
+            (query,),
+        )
+        return {
+            journal_id
+            for journal_id, memo, tags in rows
+            if tokens <= set(tokenize(memo)) | set(tokenize(tags))
+        }
+
+    def vocabulary(self):
+        """
+        Return every indexed token.
+
+        FTS5 indexes tokens case-folded and without accents, so that is how they are
+        returned.
+        """
+        return [
+            term for (term,) in self.connection.execute("SELECT term FROM journals_fts_vocab")
+        ]
+
+    def contains(self, token):
+        """
+        Return whether any journal contains a token, as returned by vocabulary.
+
+        Only changes that have been committed to the database are seen.
+        """
+        row = self.connection.execute(
+            "SELECT 1 FROM journals_fts_vocab WHERE term = ?", (token,)
+        ).fetchone()
+        return row is not None
+
+    def scores(self, tokens, phrases=(), fold=False):
+        """
+        Score journals against a query with FTS5's built-in BM25 ranking.
+
+        FTS5 always matches regardless of case and accents. Without fold, journals are
+        only kept if they contain at least one of the tokens with the same case, though
+        their scores still come from FTS5.
+
+        :param tokens: The query tokens.
+        :type tokens: iterable
+        :param phrases: Optional. The tokens of each quoted phrase in the query. Only
+            journals containing every phrase are scored.
+        :type phrases: list
+        :param fold: Optional. Match regardless of case and accents. Default is False.
+        :type fold: bool
+
+        :return: A mapping of journal ID to score, for every journal that matched.
+        :rtype: dict
+        """
+        tokens = set(tokens)
+        if not tokens:
+            return {}
+        query = " OR ".join(f'"{token}"' for token in tokens)
+        for phrase in phrases:
+            query = f'({query}) AND "{" ".join(phrase)}"'
+        rows = self.connection.execute(
+            "SELECT rowid, bm25(journals_fts), memo, tags FROM journals_fts "
+            "WHERE journals_fts MATCH ?",
+            (query,),
+        )
+        # bm25() is lower for better matches
+        return {
+            journal_id: -score
+            for journal_id, score, memo, tags in rows
+            if fold or not tokens.isdisjoint(tokenize(memo) + tokenize(tags))
+        }
+
+
+class SqliteStorage:
+    """Store journals in a SQLite database with indexed tags and dates"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS journals (
+            id INTEGER PRIMARY KEY,
+            memo TEXT NOT NULL,
+            creation_date TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS journals_creation_date ON journals (creation_date);
+        CREATE TABLE IF NOT EXISTS journal_tags (
+            journal_id INTEGER NOT NULL,
+            position INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (journal_id, position)
+        );
+        CREATE INDEX IF NOT EXISTS journal_tags_tag ON journal_tags (tag);
+        CREATE VIRTUAL TABLE IF NOT EXISTS journals_fts USING fts5 (memo, tags);
+        CREATE VIRTUAL TABLE IF NOT EXISTS journals_fts_vocab
+            USING fts5vocab (journals_fts, 'row');
+    """
+
+    def __init__(self, storage_file):
+        """
+        Open the database, creating its tables if they don't exist yet.
+
+        :param storage_file: The path of the SQLite database.
+        :type storage_file: str
+        """
+        self.storage_file = storage_file
+        # The book may be loaded on a background thread
+        self.connection = sqlite3.connect(storage_file, check_same_thread=False)
+        self.connection.executescript(self.SCHEMA)
+
+    def iter_entries(self, memos=True):
+        """
+        Stream every journal entry in the database, in ID order.
+
+        The journals and their tags are read with two cursors walked side by side, so
+        only one entry is held at a time. Each entry's location is its ID.
+
+        :param memos: Optional. Ignored; memos are always read with the entry.
+        :type memos: bool
+
+        :return: A generator of (entry dictionary, location) pairs.
+        :rtype: generator
+        """
+        tag_rows = self.connection.cursor().execute(
+            "SELECT journal_id, tag FROM journal_tags ORDER BY journal_id, position"
+        )
+        tag_row = next(tag_rows, None)
+        for journal_id, memo, creation_date in self.connection.cursor().execute(
+            "SELECT id, memo, creation_date FROM journals ORDER BY id"
+        ):
+            tags = []
+            while tag_row is not None and tag_row[0] <= journal_id:
+                if tag_row[0] == journal_id:
+                    tags.append(tag_row[1])
+                tag_row = next(tag_rows, None)
+            entry = {
+                "memo": memo,
+                "tags": tags,
+                "creation_date": creation_date,
+                "id": journal_id,
+            }
+            yield entry, journal_id
+
+    def fetch(self, location):
+        """
+        Read a single journal entry from the database.
+
+        :param location: The ID of the journal entry.
+        :type location: int
+
+        :return: The journal entry dictionary.
+        :rtype: dict
+        """
+        memo, creation_date = self.connection.execute(
+            "SELECT memo, creation_date FROM journals WHERE id = ?", (location,)
+        ).fetchone()
+        tags = [
+            tag
+            for (tag,) in self.connection.execute(
+                "SELECT tag FROM journal_tags WHERE journal_id = ? ORDER BY position",
+                (location,),
+            )
+        ]
+        return {
+            "memo": memo,
+            "tags": tags,
+            "creation_date": creation_date,
+            "id": location,
+        }
+
+    def load_log(self):
+        """Every change is written straight to the tables, so there is no log to replay."""
+        return []
+
+    def load_text_index(self):
+        """
+        Get the keyword index, which lives in the database's FTS5 table.
+
+        :return: The keyword index.
+        :rtype: FtsIndex
+        """
+        return FtsIndex(self.connection)
+
+    def append(self, record):
+        """
+        Apply a mutation record to the database inside the current transaction.
+
+        The change is not durable until commit is called.
+
+        :param record: The record, with an "op" of "add", "update" or "delete".
+        :type record: dict
+
+        :return: None
+        :rtype: None
+        """
+        op = record.get("op")
+        if op == "add":
+            self.insert_entry(record["entry"])
+        elif op == "update":
+            entry = record["entry"]
+            self.delete_entry(entry["id"])
+            self.insert_entry(entry)
+        elif op == "delete":
+            self.delete_entry(record["id"])
+
+    def insert_entry(self, entry):
+        """
+        Insert a journal entry and its tags.
+
+        :param entry: The journal entry dictionary.
+        :type entry: dict
+
+        :return: None
+        :rtype: None
+        """
+        self.connection.execute(
+            "INSERT INTO journals (id, memo, creation_date) VALUES (?, ?, ?)",
+            (entry["id"], entry["memo"], entry["creation_date"]),
+        )
+        self.connection.executemany(
+            "INSERT INTO journal_tags (journal_id, position, tag) VALUES (?, ?, ?)",
+            [(entry["id"], position, tag) for position, tag in enumerate(entry["tags"])],
+        )
+        self.connection.execute(
+            "INSERT INTO journals_fts (rowid, memo, tags) VALUES (?, ?, ?)",
+            (entry["id"], entry["memo"], " ".join(entry["tags"])),
+        )
+
+    def delete_entry(self, journal_id):
+        """
+        Delete a journal entry and its tags.
+
+        :param journal_id: The ID of the journal entry.
+        :type journal_id: int
+
+        :return: None
+        :rtype: None
+        """
+        self.connection.execute("DELETE FROM journals WHERE id = ?", (journal_id,))
+        self.connection.execute(
+            "DELETE FROM journal_tags WHERE journal_id = ?", (journal_id,)
+        )
+        self.connection.execute("DELETE FROM journals_fts WHERE rowid = ?", (journal_id,))
+
+    def commit(self):
+        """Commit the current transaction"""
+        self.connection.commit()
+
+    def rollback(self):
+        """Undo the changes made since the last commit"""
+        self.connection.rollback()
+
+    def needs_compaction(self, journal_count, incoming=0):
+        """SQLite updates rows in place, so it never needs compacting."""
+        return False
+
+    def compact(self, entries, text_index=None):
+        """
+        Replace the contents of the database with the given entries in one transaction.
+
+        :param entries: The journal entry dictionaries to write.
+        :type entries: iterable
+        :param text_index: Unused. The FTS5 table is rebuilt from the entries.
+        :type text_index: InvertedIndex, optional
+
+        :return: The location of each entry, which is its ID, in the same order.
+        :rtype: list
+        """
+        # Entries may be read lazily from this database, so collect them before clearing it
+        entries = list(entries)
+        with self.connection:
+            self.connection.execute("DELETE FROM journals")
+            self.connection.execute("DELETE FROM journal_tags")
+            self.connection.execute("DELETE FROM journals_fts")
+            for entry in entries:
+                self.insert_entry(entry)
+        return [entry["id"] for entry in entries]
+
+    def close(self):
+        """Commit any outstanding changes and close the database"""
+        self.connection.commit()
+        self.connection.close()